@@ -0,0 +1,166 @@
+import sys
+import time
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+FORMATS = {
+    'common': '{host} - - [{time}] "{request}" {status} {size}',
+    'combined': '{host} - - [{time}] "{request}" {status} {size} "{referer}" "{agent}"',
+}
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Queue handler that never waits: a record that does not fit in the
+    bounded queue is dropped and counted. Lines are formatted by the caller,
+    so records are queued as they are, without the handler lock"""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def handle(self, record):
+        self.enqueue(record)
+        return True
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _BatchWriter(RotatingFileHandler):
+    """Rotating file handler writing lines in batches: one write per
+    batch_size lines or per flush_interval seconds, whatever comes first"""
+    def __init__(self, filename, max_bytes, backup_count, batch_size, flush_interval):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batch = []
+        self.flushed_at = time.monotonic()
+        self.written = 0
+
+    def emit(self, record):
+        self.batch.append(record.msg)
+        if len(self.batch) >= self.batch_size or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.batch:
+                data = '\n'.join(self.batch) + '\n'
+                lines = len(self.batch)
+                self.batch = []
+                if self.stream is None:
+                    self.stream = self._open()
+                if self.maxBytes and self.stream.tell() and self.stream.tell() + len(data) > self.maxBytes:
+                    self.doRollover()
+                    if self.stream is None:
+                        self.stream = self._open()
+                self.stream.write(data)
+                self.written += lines
+            if self.stream is not None:
+                self.stream.flush()
+            self.flushed_at = time.monotonic()
+
+
+class _StreamBatchWriter(_BatchWriter):
+    """_BatchWriter over an already open stream (stderr), without rotation"""
+    def __init__(self, stream, batch_size, flush_interval):
+        logging.Handler.__init__(self)
+        self.stream = stream
+        self.maxBytes = 0
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batch = []
+        self.flushed_at = time.monotonic()
+        self.written = 0
+
+    def close(self):
+        self.flush()
+        logging.Handler.close(self)
+
+
+class _Listener(QueueListener):
+    """Waking up at least every flush_interval, so an idle log is still written out"""
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.handlers[0].flush_interval)
+            except queue.Empty:
+                self.handlers[0].flush()
+
+    def enqueue_sentinel(self):
+        # Waiting for room: the queue may be full when the server stops
+        self.queue.put(self._sentinel)
+
+
+class AccessLog:
+    """One line per request in common or combined log format.
+
+    Lines go to a bounded queue and a background thread writes them to `path`
+    ('-' for stderr) in batches with size-based rotation. When the writer falls
+    behind, lines are dropped and counted instead of blocking the server"""
+    def __init__(self, path, log_format='combined', max_bytes=64 * 1024 * 1024, backup_count=5,
+                 queue_size=10000, batch_size=256, flush_interval=1.):
+        if log_format not in FORMATS:
+            raise ValueError('Unknown access log format "{}". Use one of {}'.format(log_format, tuple(FORMATS)))
+        self.path = path
+        self.template = FORMATS[log_format]
+        if path == '-':
+            self.writer = _StreamBatchWriter(sys.stderr, batch_size, flush_interval)
+        else:
+            self.writer = _BatchWriter(path, max_bytes, backup_count, batch_size, flush_interval)
+        self.handler = _DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        self.listener = None
+        # (second, formatted time). Replaced as a whole like reqresp._date_line
+        self._time = (0, '')
+
+    def start(self):
+        if self.listener is None:
+            self.listener = _Listener(self.handler.queue, self.writer)
+            self.listener.start()
+
+    def stop(self):
+        """Writing out queued lines and stopping the writer thread"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.writer.flush()
+
+    def log(self, address, request, response):
+        """Queueing the line for the answered request. `request` is None for
+        requests the parser rejected"""
+        if request is None:
+            request_line, referer, agent = '-', '-', '-'
+        else:
+            request_line = '{} {} {}'.format(request.method, request.target, request.version)
+            referer = request.headers.get('referer', '-')
+            agent = request.headers.get('user-agent', '-')
+        size = 0 if response.header_only or response.status == 304 else response.content_length()
+        line = self.template.format(host=address[0] if address else '-', time=self._now(),
+                                    request=_escape(request_line), status=response.status, size=size or '-',
+                                    referer=_escape(referer), agent=_escape(agent))
+        record = logging.LogRecord('pyserver.access', logging.INFO, '', 0, line, None, None)
+        self.handler.handle(record)
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    @property
+    def written(self):
+        return self.writer.written
+
+    def _now(self):
+        now = int(time.time())
+        second, text = self._time
+        if second != now:
+            text = time.strftime('%d/%b/%Y:%H:%M:%S %z', time.localtime(now))
+            self._time = (now, text)
+        return text
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
@@ -0,0 +1,234 @@
+import asyncio
+import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from HW_kesson_7.httpd import PyServer, _reset_on_close
+from HW_kesson_7.parser import RequestError
+from HW_kesson_7.reqresp import BaseAnswer, FileAnswer, StreamAnswer
+
+
+class AsyncPyServer(PyServer):
+    """asyncio variant of PyServer.
+
+    Connections are served by coroutines on one event loop. Static files go
+    through the PyServer handler (cache, ranges, compression, validators) in
+    a bounded thread pool, so disk access never blocks the loop. Dynamic
+    routes are async handlers returning reqresp answers:
+
+        server = AsyncPyServer(port=8080)
+
+        @server.route('/api/time')
+        async def current_time(request):
+            return BaseAnswer(200, content_type='txt', content=str(time.time()))
+
+    Handlers may return StreamAnswer with a (preferably async) iterator of
+    chunks to send big or slowly generated bodies in constant memory"""
+    MODES = PyServer.MODES + ('asyncio', )
+
+    def __init__(self, *args, mode='asyncio', executor_workers=8, **kwargs):
+        super().__init__(*args, mode=mode, **kwargs)
+        self.executor_workers = executor_workers
+        self.sendfile_slice = 256 * 1024
+        self.routes = {}
+        self._loop = None
+        self._stopped = None
+
+    def route(self, path, methods=('GET', 'HEAD')):
+        """Decorator registering async handler for the exact request path"""
+        def wrapper(handler):
+            self.routes[path] = (handler, methods)
+            return handler
+        return wrapper
+
+    def stop(self):
+        """Shutting down method. Safe to call from other threads and signal handlers"""
+        super().stop()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    def _run_loop(self):
+        """Serving loop of the configured mode"""
+        if self.mode != 'asyncio':
+            return super()._run_loop()
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._loop.set_default_executor(ThreadPoolExecutor(self.executor_workers))
+        connections = set()
+
+        def on_connection(reader, writer):
+            task = asyncio.ensure_future(self._query_handler_async(reader, writer))
+            connections.add(task)
+            task.add_done_callback(connections.discard)
+
+        server = await asyncio.start_server(on_connection, sock=self.socket)
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            for task in list(connections):
+                task.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+
+    async def _query_handler_async(self, reader, writer):
+        """Handling process of receiving and sending data over one connection"""
+        parser = self._create_parser()
+        served = 0
+        address = writer.get_extra_info('peername')
+        self.metrics.connection_opened()
+        phase = deadline = None
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = parser.next_request()
+                except RequestError as error:
+                    response = self._error_response(error)
+                    await self._write(writer, response)
+                    if self.access_log is not None:
+                        self.access_log.log(address, None, response)
+                    break
+                if request is None:
+                    current = self._read_phase(parser, 'idle' if served else 'header')
+                    if current != phase:
+                        phase, deadline = current, self._loop.time() + self.timeouts[current]
+                    try:
+                        data = await asyncio.wait_for(reader.read(self.chunk_size),
+                                                      max(deadline - self._loop.time(), 0))
+                    except asyncio.TimeoutError:
+                        self.metrics.count_timeout(phase)
+                        if phase != 'idle':
+                            writer.write(self._timeout_response().head())
+                        break
+                    if not data:
+                        break
+                    parser.feed(data)
+                    continue
+
+                served += 1
+                keep_alive = self._keep_alive(request, served)
+                response = await self._respond(request, keep_alive)
+                if isinstance(response, StreamAnswer) and not response.chunked:
+                    # The body ends when the connection is closed
+                    keep_alive = False
+                await self._write(writer, response)
+                if self.access_log is not None:
+                    self.access_log.log(address, request, response)
+        except asyncio.TimeoutError:
+            self.metrics.count_timeout('write')
+            _reset_on_close(writer.get_extra_info('socket'))
+            writer.transport.abort()
+        except ConnectionError:
+            pass
+        except OSError as se:
+            logging.critical('Socket exception occurred.')
+            logging.critical('{}'.format(se))
+            writer.transport.abort()
+        except Exception:
+            # A bug hit by one connection must not go unnoticed in the task
+            logging.exception('Unexpected error while serving {}. Closing the connection.'.format(address))
+            writer.transport.abort()
+        finally:
+            self.metrics.connection_closed()
+            writer.close()
+
+    async def _respond(self, request, keep_alive):
+        """Answer from a registered route or from static files"""
+        route = self.routes.get(request.path)
+        if route is None:
+            return await self._loop.run_in_executor(None, self._build_response, request, keep_alive)
+        response = await self._route_answer(route, request, keep_alive)
+        self._count_response(response)
+        return response
+
+    async def _route_answer(self, route, request, keep_alive):
+        handler, methods = route
+        headers = {'Connection': 'keep-alive' if keep_alive else 'close'}
+        if request.method not in methods:
+            return BaseAnswer(405, headers=headers)
+        try:
+            response = await handler(request)
+        except Exception as exc:
+            logging.critical('Handler for {} failed: {}'.format(request.path, exc))
+            return BaseAnswer(500, headers=headers)
+        if not isinstance(response, BaseAnswer):
+            logging.critical('Handler for {} returned {!r} instead of an answer'.format(request.path, response))
+            return BaseAnswer(500, headers=headers)
+        if isinstance(response, StreamAnswer) and request.version == 'HTTP/1.0':
+            response.chunked = False
+            headers['Connection'] = 'close'
+        response.headers.update(headers)
+        if request.method == 'HEAD':
+            response.header_only = True
+        response.update()
+        return response
+
+    async def _write(self, writer, response):
+        """Send data method. File bodies go through loop.sendfile (os.sendfile when possible).
+        Every wait for the client to take the data is limited by the write timeout"""
+        writer.write(response.head())
+        if isinstance(response, StreamAnswer):
+            await self._drain(writer)
+            await self._write_stream(writer, response)
+        elif response.header_only:
+            await self._drain(writer)
+        elif isinstance(response, FileAnswer):
+            await self._drain(writer)
+            if response.size:
+                with open(response.path, 'rb') as f:
+                    # In slices, so a stalled reader hits the write timeout
+                    for offset in range(0, response.size, self.sendfile_slice):
+                        count = min(self.sendfile_slice, response.size - offset)
+                        await asyncio.wait_for(self._loop.sendfile(writer.transport, f, offset, count),
+                                               self.timeouts['write'])
+        else:
+            await self._write_parts(writer, response.parts())
+
+    async def _write_parts(self, writer, parts):
+        """Writing buffers (RangeAnswer slices of a mapped file may be huge) in
+        slices of sendfile_slice, draining after each: the transport buffers at
+        most one slice and a stalled reader hits the write timeout per slice"""
+        pending = 0
+        for part in parts:
+            with memoryview(part) as view:
+                for offset in range(0, len(view), self.sendfile_slice):
+                    piece = view[offset:offset + self.sendfile_slice]
+                    writer.write(piece)
+                    pending += len(piece)
+                    if pending >= self.sendfile_slice:
+                        await self._drain(writer)
+                        pending = 0
+        await self._drain(writer)
+
+    async def _write_stream(self, writer, response):
+        """Sending chunks as they are produced. The next chunk is taken only
+        after the previous one is accepted by the transport"""
+        try:
+            if not response.header_only:
+                if hasattr(response.chunks, '__aiter__'):
+                    async for chunk in response.chunks:
+                        writer.writelines(response.frame(chunk))
+                        await self._drain(writer)
+                else:
+                    for chunk in response.chunks:
+                        writer.writelines(response.frame(chunk))
+                        await self._drain(writer)
+                if response.chunked:
+                    writer.write(response.last_chunk)
+                    await self._drain(writer)
+        except (asyncio.TimeoutError, ConnectionError):
+            raise
+        except Exception as exc:
+            # The head is sent already, so the only way to report the failure is an incomplete body
+            logging.critical('Streamed answer failed: {}'.format(exc))
+            raise ConnectionAbortedError(exc)
+        finally:
+            closed = response.close()
+            if inspect.isawaitable(closed):
+                await closed
+
+    async def _drain(self, writer):
+        await asyncio.wait_for(writer.drain(), self.timeouts['write'])
@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from HW_kesson_7.loadgen import LoadGenerator
+
+
+# name: (request mix, connections)
+PROFILES = {
+    'tiny': ([('GET', '/index.html', 1)], 16),
+    'assets': ([('GET', '/assets/asset_{}.jpg'.format(i), 1) for i in range(20)], 16),
+    'large': ([('GET', '/media/large_{}.jpg'.format(i), 1) for i in range(2)], 4),
+    'many_paths': ([('GET', '/pages/page_{}.html'.format(i), 1) for i in range(500)], 16),
+    'mixed': ([('GET', '/index.html', 60), ('HEAD', '/assets/asset_0.jpg', 10), ('GET', '/assets/asset_1.jpg', 20),
+               ('GET', '/pages/page_7.html', 9), ('GET', '/missing.html', 1)], 16),
+}
+
+
+def generate_document_root(root, seed=0):
+    """Writing deterministic test files: tiny pages, 100 KB assets and multi-MB media"""
+    rand = random.Random(seed)
+    for directory in ('assets', 'media', 'pages'):
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+    with open(os.path.join(root, 'index.html'), 'w') as f:
+        f.write('<html><body>PyServer benchmark</body></html>\n')
+    for i in range(500):
+        with open(os.path.join(root, 'pages', 'page_{}.html'.format(i)), 'w') as f:
+            f.write('<html><body>{}</body></html>\n'.format(' '.join(str(rand.random()) for _ in range(20))))
+    for i in range(20):
+        with open(os.path.join(root, 'assets', 'asset_{}.jpg'.format(i)), 'wb') as f:
+            f.write(rand.randbytes(100 * 1024))
+    for i in range(2):
+        with open(os.path.join(root, 'media', 'large_{}.jpg'.format(i)), 'wb') as f:
+            f.write(rand.randbytes(8 * 1024 * 1024))
+
+
+def _run_server(options, port_pipe):
+    """Server process entry point"""
+    from HW_kesson_7.httpd import PyServer
+    logging.getLogger().setLevel(logging.WARNING)
+    server = PyServer(port=0, **options)
+    port_pipe.send(server.socket.getsockname()[1])
+    server.launch()
+
+
+def _process_tree(pid):
+    """Pid and all its descendants (pre-fork workers)"""
+    pids = [pid]
+    for current in pids:
+        try:
+            with open('/proc/{0}/task/{0}/children'.format(current)) as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def resource_usage(pid):
+    """CPU seconds and RSS in KB of the process tree, read from /proc (zeros elsewhere)"""
+    ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    cpu, rss = 0., 0
+    for current in _process_tree(pid):
+        try:
+            with open('/proc/{}/stat'.format(current)) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            with open('/proc/{}/status'.format(current)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1])
+        except (OSError, IndexError, ValueError):
+            pass
+    return cpu, rss
+
+
+def run_benchmark(server_options=None, profiles=None, duration=5., seed=0):
+    """Starting PyServer on a generated document root and running the load profiles"""
+    profiles = profiles or list(PROFILES)
+    with tempfile.TemporaryDirectory(prefix='pyserver-bench-') as root:
+        generate_document_root(root, seed)
+        options = dict(server_options or {}, document_root=root)
+
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run_server, args=(options, sender), daemon=True)
+        process.start()
+        try:
+            port = receiver.recv()
+            _wait_for_port(port)
+            results = {}
+            for name in profiles:
+                mix, connections = PROFILES[name]
+                cpu_before, _ = resource_usage(process.pid)
+                report = LoadGenerator('127.0.0.1', port, mix=mix, connections=connections, duration=duration,
+                                       seed=seed).run()
+                cpu_after, rss = resource_usage(process.pid)
+                report['server_cpu_seconds'] = cpu_after - cpu_before
+                report['server_rss_kb'] = rss
+                results[name] = report
+                logging.warning('{}: {:.0f} rps, p99 {:.2f} ms'.format(
+                    name, report['throughput'], report['latency_ms']['p99']))
+        finally:
+            process.terminate()
+            process.join()
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'duration': duration,
+            'server_options': server_options or {},
+        },
+        'profiles': results,
+    }
+
+
+def _wait_for_port(port, timeout=10.):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def compare(results, baseline, threshold=0.1):
+    """Comparing results with the baseline. Returns list of regression messages:
+    throughput lower or p99 latency higher than baseline by more than threshold"""
+    regressions = []
+    for name, report in results['profiles'].items():
+        base = baseline.get('profiles', {}).get(name)
+        if base is None:
+            continue
+        if report['throughput'] < base['throughput'] * (1 - threshold):
+            regressions.append('{}: throughput {:.0f} rps < baseline {:.0f} rps'.format(
+                name, report['throughput'], base['throughput']))
+        if report['latency_ms']['p99'] > base['latency_ms']['p99'] * (1 + threshold):
+            regressions.append('{}: p99 {:.2f} ms > baseline {:.2f} ms'.format(
+                name, report['latency_ms']['p99'], base['latency_ms']['p99']))
+        if report['errors'] > base['errors']:
+            regressions.append('{}: {} errors > baseline {}'.format(name, report['errors'], base['errors']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='PyServer benchmark with baseline comparison')
+    parser.add_argument('--output', default='-', help='results JSON file, "-" for stdout')
+    parser.add_argument('--baseline', help='results JSON to compare with')
+    parser.add_argument('--save-baseline', help='also write the results to this file')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative regression')
+    parser.add_argument('--duration', type=float, default=5., help='seconds per profile')
+    parser.add_argument('--profile', action='append', choices=sorted(PROFILES), help='may be repeated')
+    parser.add_argument('--mode', default='threaded', help='PyServer serving mode')
+    parser.add_argument('--workers', type=int, default=50)
+    parser.add_argument('--prefork', type=int, default=0, help='number of worker processes, 0 disables pre-fork')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    # Per-request client logging would measure the logger instead of the server
+    logging.getLogger().setLevel(logging.WARNING)
+    server_options = {'mode': args.mode, 'workers': args.workers}
+    if args.prefork:
+        server_options.update(prefork=True, processes=args.prefork)
+    results = run_benchmark(server_options, args.profile, args.duration, args.seed)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for message in regressions:
+            logging.critical('Regression: {}'.format(message))
+        if regressions:
+            sys.exit(1)
+        logging.warning('No regressions against {}'.format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
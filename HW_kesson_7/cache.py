@@ -0,0 +1,169 @@
+import os
+import stat
+import time
+from threading import Lock
+from collections import OrderedDict
+from HW_kesson_7.reqresp import BaseAnswer
+
+
+class CacheEntry:
+    """File body with its pre-built entity headers and the stat it was read with"""
+    def __init__(self, path, file_stat, content_type, body=None):
+        self.path = path
+        self.stat = file_stat
+        self.content_type = content_type
+        self.body = body
+        self.entity_headers = None
+        if body is not None:
+            self.entity_headers = BaseAnswer(200, content_type=content_type, content=body).entity_headers()
+        self.checked_at = time.monotonic()
+
+    def matches(self, file_stat):
+        """Whether the file on disk is still the one the body was read from"""
+        return (self.stat.st_ino == file_stat.st_ino and
+                self.stat.st_size == file_stat.st_size and
+                self.stat.st_mtime_ns == file_stat.st_mtime_ns)
+
+    @property
+    def size(self):
+        return len(self.body) if self.body is not None else 0
+
+
+class _ByteBudgetLRU:
+    """Storage part of the caches: LRU order, byte budget and counters.
+    Values must have `size` attribute"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def discard(self, key, invalidated=False):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry.size
+                if invalidated:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _store(self, key, entry):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.size
+            self.entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+
+class FileCache(_ByteBudgetLRU):
+    """Byte-budgeted LRU cache of file bodies keyed by resolved path.
+    Entries are revalidated with stat (inode, size, mtime) at most once
+    per revalidate_interval seconds"""
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_size=1024 * 1024, revalidate_interval=1.):
+        super().__init__(max_bytes)
+        self.max_entry_size = min(max_entry_size, max_bytes)
+        self.revalidate_interval = revalidate_interval
+
+    def get(self, path, content_type):
+        """Returning entry for the file. Entries of files bigger than
+        max_entry_size have no body and are not stored.
+        Raises FileNotFoundError for missing and non-regular files"""
+        path = os.path.normpath(path)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                self.entries.move_to_end(path)
+                if now - entry.checked_at < self.revalidate_interval:
+                    self.hits += 1
+                    return entry
+
+        try:
+            file_stat = os.stat(path)
+        except FileNotFoundError:
+            self.discard(path)
+            raise
+        if not stat.S_ISREG(file_stat.st_mode):
+            self.discard(path)
+            raise FileNotFoundError(path)
+
+        if entry is not None:
+            if entry.matches(file_stat):
+                entry.checked_at = now
+                with self.lock:
+                    self.hits += 1
+                return entry
+            self.discard(path, invalidated=True)
+
+        with self.lock:
+            self.misses += 1
+        if file_stat.st_size > self.max_entry_size:
+            return CacheEntry(path, file_stat, content_type)
+
+        with open(path, 'rb') as f:
+            body = f.read()
+        entry = CacheEntry(path, file_stat, content_type, body)
+        if len(body) != file_stat.st_size:
+            # File changed while reading, do not keep an inconsistent entry
+            return entry
+        self._store(path, entry)
+        return entry
+
+
+class CompressedBody:
+    """Encoded variant of a file body"""
+    def __init__(self, body):
+        self.body = body
+
+    @property
+    def size(self):
+        return len(self.body)
+
+
+class CompressedCache(_ByteBudgetLRU):
+    """Byte-budgeted LRU cache of compressed bodies. Keys include file identity
+    and mtime, so a changed file never hits an old variant"""
+    @staticmethod
+    def key(path, file_stat, coding):
+        return os.path.normpath(path), file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns, coding
+
+    def get(self, path, file_stat, coding):
+        key = self.key(path, file_stat, coding)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.body
+
+    def put(self, path, file_stat, coding, body):
+        entry = CompressedBody(body)
+        if entry.size <= self.max_bytes:
+            self._store(self.key(path, file_stat, coding), entry)
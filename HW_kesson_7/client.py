@@ -45,15 +45,25 @@ class PyServerClient:
             return self.pow ** self.counter
 
     @_process_logger(before='Creating PyServerClient')
-    def __init__(self):
+    def __init__(self, timeout=None):
+        self.timeout = timeout
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
         self.terminator = '\r\n\r\n'
         self.chunk_size = 2048
+        self.address = None
+        self.connected = False
+        self.buffer = bytearray()
 
     def connect(self, host, port, attempts=5, timeout_fun=TimeoutWaiter()):
+        if self.connected and self.address == (host, port):
+            # Persistent connection is reused
+            return
         logging.info('Connecting to {}:{}'.format(host, port))
+        self.address = (host, port)
         try:
             self.socket.connect((host, port))
+            self.connected = True
         except OSError:
             logging.warning('Can not connect. Trying to reconnect...')
             current_attempt = 0
@@ -75,24 +85,95 @@ class PyServerClient:
     @_process_logger(before='Reconnection...')
     def reconnect(self, host, port):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.settimeout(self.timeout)
         self.socket.connect((host, port))
+        self.address = (host, port)
+        self.connected = True
+        self.buffer = bytearray()
 
     def send_all(self, message):
         """Send data string method"""
-        logging.info('Sending message "{}"'.format(message))
+        # Lazy formatting: nothing is built when debug output is off
+        logging.debug('Sending message "%s"', message)
         self.socket.sendall((message + self.terminator).encode('utf-8'))
 
-    def receive_all(self):
-        """Receive data string method"""
-        data = ''
-        while True:
-            data += self.socket.recv(self.chunk_size).decode('utf-8')
-            if self.terminator in data:
-                break
-        return data[:-4]
+    def receive_all(self, header_only=False):
+        """Receive data string method. Returns response head, the body is
+        consumed so the next response can be read from the same connection"""
+        head, body = self.receive_response(header_only=header_only)
+        return head
+
+    def receive_response(self, header_only=False):
+        """Receive one response from the stream. Returns head string and body bytes"""
+        terminator = self.terminator.encode('utf-8')
+        while terminator not in self.buffer:
+            self._fill_buffer()
+        end = self.buffer.find(terminator)
+        head = self.buffer[:end].decode('utf-8')
+        del self.buffer[:end + len(terminator)]
+
+        length = 0 if header_only else self._content_length(head)
+        while len(self.buffer) < length:
+            self._fill_buffer()
+        body = bytes(self.buffer[:length])
+        del self.buffer[:length]
+
+        if 'connection: close' in head.lower():
+            self.close_connection()
+        return head, body
+
+    def request(self, message, attempts=2):
+        """Send request over the persistent connection and return response head.
+        A connection closed by the server while idle is reopened"""
+        header_only = str(message).startswith('HEAD')
+        for attempt in range(attempts):
+            if not self.connected:
+                self.reconnect(*self.address)
+            try:
+                self.send_all(str(message))
+                return self.receive_all(header_only=header_only)
+            except (ConnectionError, BrokenPipeError):
+                self.close_connection()
+                if attempt == attempts - 1:
+                    raise
+            except (OSError, ValueError):
+                # Timeout or malformed response: the rest of this response may still
+                # arrive, so the connection can not carry the next request
+                self.close_connection()
+                raise
+
+    def pipeline(self, messages):
+        """Send all requests at once, then read responses in the same order"""
+        if not self.connected:
+            self.reconnect(*self.address)
+        payload = ''.join(str(message) + self.terminator for message in messages)
+        logging.info('Sending {} pipelined messages'.format(len(messages)))
+        try:
+            self.socket.sendall(payload.encode('utf-8'))
+            return [self.receive_all(header_only=str(message).startswith('HEAD')) for message in messages]
+        except (OSError, ValueError):
+            self.close_connection()
+            raise
+
+    def _fill_buffer(self):
+        chunk = self.socket.recv(self.chunk_size)
+        if not chunk:
+            self.close_connection()
+            raise ConnectionResetError('Connection closed by server')
+        self.buffer += chunk
+
+    @staticmethod
+    def _content_length(head):
+        for line in head.split('\r\n')[1:]:
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                return int(value)
+        return 0
 
     def close_connection(self):
         self.socket.close()
+        self.connected = False
+        self.buffer = bytearray()
 
 
 if __name__ == '__main__':
@@ -101,18 +182,16 @@ if __name__ == '__main__':
     server_host = '127.0.0.1'
     server_port = 8080
 
+    try:
+        client.connect(server_host, server_port)
+    except Exception as e:
+        print(e)
+        sys.exit()
+
     response = []
     for i in range(5):
-        try:
-            client.connect(server_host, server_port)
-        except Exception as e:
-            print(e)
-            sys.exit()
-
         request = rr.GetRequest(server_host, body='//')
-
-        client.send_all(str(request))
-        response.append(client.receive_all())
-        client.close_connection()
+        response.append(client.request(request))
+    client.close_connection()
     for val in response:
         print(val)
@@ -0,0 +1,43 @@
+import gzip
+import zlib
+
+
+# Content codings in order of preference
+CODINGS = ('gzip', 'deflate')
+# Content types worth compressing, images are compressed already
+COMPRESSIBLE = frozenset(('txt', 'html', 'htm', 'css', 'js', 'json', 'xml', 'svg'))
+
+
+def negotiate(accept_encoding, available=CODINGS):
+    """Choosing content coding from Accept-Encoding. Returns None for identity"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        weight = 1.
+        params = params.strip().lower()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.
+        weights[name.strip().lower()] = weight
+
+    best, best_weight = None, 0.
+    for coding in available:
+        weight = weights.get(coding, weights.get('*', 0.))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def compress(body, coding, level=6):
+    """Encoding body with the content coding"""
+    if coding == 'gzip':
+        # Fixed mtime keeps the output identical for the same input
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    if coding == 'deflate':
+        # HTTP "deflate" is the zlib format
+        return zlib.compress(body, level)
+    raise ValueError('Unknown content coding "{}"'.format(coding))
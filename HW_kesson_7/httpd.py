@@ -1,17 +1,87 @@
+import os
 import sys
+import time
+import signal
+import struct
 import socket
 import logging
-import re
+import stat
+import selectors
+import queue
+import atexit
+from logging.handlers import QueueHandler, QueueListener
+from itertools import islice
+from collections import deque
 from threading import Thread
 from HW_kesson_7.reqresp import *
+from HW_kesson_7.cache import FileCache, CompressedCache
+from HW_kesson_7.encoding import COMPRESSIBLE, negotiate, compress
+from HW_kesson_7.parser import RequestParser, RequestError
+from HW_kesson_7.ranges import MmapRegistry, RangeNotSatisfiable, parse_range, if_range_matches
+from HW_kesson_7.metrics import Metrics
+from HW_kesson_7.accesslog import AccessLog
+from HW_kesson_7.resolver import PathResolver
+from HW_kesson_7.timers import TimerHeap
 
 
+# Records are handed to a background thread, so serving threads never wait on stream I/O
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('[%(asctime)s]\t%(levelname)-8s\t%(message)s'))
+_log_queue_handler = QueueHandler(queue.SimpleQueue())
+# The message is merged with its arguments before queueing, the listener adds the rest
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+_log_listener = None
 logging.basicConfig(
-    format='[%(asctime)s]\t%(levelname)-8s\t%(message)s',
-    level=logging.DEBUG
+    level=logging.DEBUG,
+    handlers=[_log_queue_handler]
 )
 
 
+def _start_log_listener():
+    """Starting the log writer thread on a fresh queue. Called again in forked
+    children: the thread does not survive fork and parent records must not repeat"""
+    global _log_listener
+    _log_queue_handler.queue = queue.SimpleQueue()
+    _log_listener = QueueListener(_log_queue_handler.queue, _log_handler)
+    _log_listener.start()
+
+
+def _stop_log_listener():
+    """Writing out queued records"""
+    if _log_listener is not None:
+        _log_listener.stop()
+
+
+_start_log_listener()
+atexit.register(_stop_log_listener)
+os.register_at_fork(after_in_child=_start_log_listener)
+
+
+_HAS_SENDFILE = hasattr(os, 'sendfile')
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+# Tells the kernel more data follows, so the head goes out in one segment with the file
+_MSG_MORE = getattr(socket, 'MSG_MORE', 0)
+# Buffers passed to one sendmsg call, well below IOV_MAX
+_IOV_BATCH = 64
+
+
+class DeadlineExceeded(socket.timeout):
+    """Connection deadline passed while waiting for the client. `phase` is
+    'header', 'body' or 'idle'"""
+    def __init__(self, phase):
+        super().__init__('{} timeout'.format(phase))
+        self.phase = phase
+
+
+def _reset_on_close(client_socket):
+    """Zero linger: close() drops unsent data and sends RST instead of
+    keeping the buffers until a stalled reader takes them"""
+    try:
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    except OSError:
+        pass
+
+
 def _process_logger(before=None, after=None):
     def wrapper(f):
         def wrapped(*args, **kwargs):
@@ -25,106 +95,879 @@ def _process_logger(before=None, after=None):
     return wrapper
 
 
+def _send_buffers(client_socket, buffers, flags=0):
+    """Sending several buffers with one sendmsg (writev) call. Returns bytes sent"""
+    if _HAS_SENDMSG:
+        return client_socket.sendmsg(buffers, (), flags)
+    return client_socket.send(buffers[0], flags)
+
+
+def _advance(buffers, sent):
+    """Dropping `sent` bytes from the front of a deque of memoryviews"""
+    while sent:
+        first = buffers[0]
+        if sent < len(first):
+            buffers[0] = first[sent:]
+            return
+        sent -= len(first)
+        buffers.popleft()
+
+
+class _FileSlice:
+    """Part of a file waiting to be sent to a non-blocking socket"""
+    def __init__(self, path, offset, count):
+        self.file = open(path, 'rb')
+        self.offset = offset
+        self.end = offset + count
+
+    def send(self, client_socket, chunk_size):
+        """Sending next piece of the file. Returns False while data remains"""
+        count = self.end - self.offset
+        if _HAS_SENDFILE:
+            # Zero-copy: the kernel moves pages from page cache to the socket
+            sent = os.sendfile(client_socket.fileno(), self.file.fileno(), self.offset, count)
+            if not sent:
+                raise OSError('File {} was truncated while sending'.format(self.file.name))
+        else:
+            self.file.seek(self.offset)
+            sent = client_socket.send(self.file.read(min(count, chunk_size)))
+        self.offset += sent
+        return self.offset >= self.end
+
+    def close(self):
+        self.file.close()
+
+
+class _Connection:
+    """Non-blocking client connection. Switches between reading requests
+    and writing responses, driven by selector events. Pipelined requests
+    are answered in order; the connection is reused while keep-alive holds.
+    Every phase (header, body, idle, write) has a deadline in the timer heap"""
+    READING, WRITING, CLOSED = range(3)
+
+    def __init__(self, server, client_socket, address, selector, timers):
+        self.server = server
+        self.socket = client_socket
+        self.address = address
+        self.selector = selector
+        self.timers = timers
+        self.state = self.READING
+        self.parser = server._create_parser()
+        self.scratch = bytearray(server.chunk_size)
+        # Queue of response parts: memoryviews of bytes and _FileSlice objects
+        self.outbox = deque()
+        self.served = 0
+        self.keep_alive = True
+        # The first request is expected right away
+        self.phase = None
+        self._set_deadline('header')
+        # perf_counter of the first bytes of the pending request and of the first pending write
+        self.read_started = None
+        self.send_started = None
+        server.metrics.connection_opened()
+
+    def handle(self, mask):
+        try:
+            if mask & selectors.EVENT_READ and self.state == self.READING:
+                self._on_readable()
+            if mask & selectors.EVENT_WRITE and self.state == self.WRITING:
+                self._on_writable()
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as se:
+            logging.critical('Socket exception occurred.')
+            logging.critical('{}'.format(se))
+            self.close()
+        except Exception:
+            # A bug hit by one connection must not stop the loop serving the others
+            logging.exception('Unexpected error while serving {}. Closing the connection.'.format(self.address))
+            self.close()
+
+    def _on_readable(self):
+        received = self.socket.recv_into(self.scratch)
+        if not received:
+            self.close()
+            return
+        if self.read_started is None:
+            self.read_started = time.perf_counter()
+        with memoryview(self.scratch) as view:
+            self.parser.feed(view[:received])
+        self._process_inbox()
+
+    def _process_inbox(self):
+        """Answering every complete request in the buffer"""
+        metrics = self.server.metrics
+        while self.keep_alive:
+            parse_started = time.perf_counter()
+            try:
+                request = self.parser.next_request()
+            except RequestError as error:
+                self.keep_alive = False
+                request = None
+                response = self.server._error_response(error)
+            else:
+                if request is None:
+                    break
+                now = time.perf_counter()
+                metrics.observe('parse', now - parse_started)
+                metrics.observe('read', parse_started - self.read_started)
+                # The next pipelined request is already here
+                self.read_started = now if self.parser.has_data() else None
+                self.served += 1
+                self.keep_alive = self.server._keep_alive(request, self.served)
+                response = self.server._build_response(request, keep_alive=self.keep_alive)
+            if self.server.access_log is not None:
+                self.server.access_log.log(self.address, request, response)
+            if not self.outbox:
+                self.send_started = time.perf_counter()
+            self.outbox.append(memoryview(response.head()))
+            if response.header_only:
+                continue
+            if isinstance(response, FileAnswer):
+                if response.size:
+                    self.outbox.append(_FileSlice(response.path, 0, response.size))
+            else:
+                self.outbox.extend(memoryview(part) for part in response.parts() if len(part))
+
+        if self.outbox:
+            self.state = self.WRITING
+            self.selector.modify(self.socket, selectors.EVENT_WRITE, self)
+            # Most responses fit in the socket buffer, so try right away
+            self._on_writable()
+        elif self.state == self.READING:
+            self._set_deadline(self.server._read_phase(self.parser))
+
+    def _on_writable(self):
+        # Called when the socket has room, so the client is making progress
+        self._set_deadline('write')
+        while self.outbox:
+            part = self.outbox[0]
+            if isinstance(part, _FileSlice):
+                if part.send(self.socket, self.server.chunk_size):
+                    part.close()
+                    self.outbox.popleft()
+                continue
+            # Heads and bodies of all pending responses go out in one syscall
+            batch = []
+            for part in islice(self.outbox, _IOV_BATCH):
+                if isinstance(part, _FileSlice):
+                    break
+                batch.append(part)
+            flags = _MSG_MORE if len(batch) < len(self.outbox) else 0
+            _advance(self.outbox, _send_buffers(self.socket, batch, flags))
+
+        self.server.metrics.observe('send', time.perf_counter() - self.send_started)
+        if not self.keep_alive:
+            self.close()
+            return
+        self.state = self.READING
+        self.selector.modify(self.socket, selectors.EVENT_READ, self)
+        self._process_inbox()
+
+    def _set_deadline(self, phase):
+        """Starting the phase deadline. Write deadline restarts on every progress"""
+        if phase != self.phase or phase == 'write':
+            self.phase = phase
+            self.timers.set(self, time.monotonic() + self.server.timeouts[phase])
+
+    def expire(self):
+        """Closing the connection whose deadline passed"""
+        self.server.metrics.count_timeout(self.phase)
+        if self.phase == 'write':
+            _reset_on_close(self.socket)
+        elif self.phase != 'idle' and not self.outbox:
+            self.server._send_timeout_response(self.socket)
+        self.close()
+
+    def close(self):
+        if self.state == self.CLOSED:
+            return
+        self.state = self.CLOSED
+        self.timers.cancel(self)
+        self.server.metrics.connection_closed()
+        for part in self.outbox:
+            if isinstance(part, _FileSlice):
+                part.close()
+        self.outbox.clear()
+        try:
+            self.selector.unregister(self.socket)
+        except (KeyError, ValueError):
+            pass
+        self.socket.close()
+
+
 class PyServer:
+    MODES = ('threaded', 'eventloop')
+    DEFAULT_MAX_AGE = {
+        'html': 0,
+        'txt': 0,
+        'css': 3600,
+        'js': 3600,
+        'jpg': 86400,
+        'jpeg': 86400,
+        'png': 86400,
+        'gif': 86400,
+        'swf': 86400
+    }
 
     @_process_logger(before='Creating Python HTTP Server...')
-    def __init__(self, host='127.0.0.1', port=8080, workers=50, socket_timeout=100.):
-        logging.info('Created on {}:{}'.format(host, port))
-        self.DOCUMENT_ROOT = '../../http-test-suite/httptest'
-        self.terminator = '\r\n\r\n'
+    def __init__(self, host='127.0.0.1', port=8080, workers=50, socket_timeout=100., mode='threaded',
+                 poll_interval=0.5, queue_size=100, backlog=None, prefork=False, processes=None,
+                 reuse_port=False, shutdown_timeout=10., keepalive_timeout=5., max_keepalive_requests=100,
+                 cache_size=64 * 1024 * 1024, cache_max_entry_size=1024 * 1024, cache_revalidate_interval=1.,
+                 max_header_bytes=8192, max_body_bytes=1024 * 1024, compression=True, compress_min_size=1024,
+                 compress_max_size=1024 * 1024, compress_level=6, compression_cache_size=16 * 1024 * 1024,
+                 max_age=None, weak_etags=False, document_root='../../http-test-suite/httptest',
+                 metrics_path='/__metrics', log_every=100, access_log=None, access_log_format='combined',
+                 access_log_max_bytes=64 * 1024 * 1024, access_log_backups=5, index_file='index.html',
+                 resolver_cache_size=10000, resolver_scan_interval=2., warmup=False, warmup_max_size=None,
+                 header_timeout=10., body_timeout=30., write_timeout=30.):
+        if mode not in self.MODES:
+            raise ValueError('Unknown server mode "{}". Use one of {}'.format(mode, self.MODES))
+        logging.info('Created on {}:{} ({} mode)'.format(host, port, mode))
+        self.DOCUMENT_ROOT = document_root
+        # Request paths are decoded, normalised and mapped to files once, then memoised
+        self.resolver = PathResolver(document_root, index_file, resolver_cache_size, resolver_scan_interval)
+        # Startup index of the tree and preloading of files up to warmup_max_size into the caches
+        self.warmup = warmup
+        self.warmup_max_size = cache_max_entry_size if warmup_max_size is None else warmup_max_size
+        self.warmup_stats = None
         self.workers = workers
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.bind((host, port))
-        self.socket.listen(workers)
-        self.socket.settimeout(socket_timeout)
+        self.address = (host, port)
+        self.backlog = backlog or workers
+        self.socket_timeout = socket_timeout
+        self.reuse_port = reuse_port
+        self.socket = self._create_socket()
         self.__shutdown_request = False
         self.chunk_size = 2048
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.accept_queue = queue.Queue(maxsize=queue_size)
+        self.rejected = 0
+        self.keepalive_timeout = keepalive_timeout
+        # Per-connection deadlines. header and body limit the whole time to receive the request head
+        # (from the first byte) and body, idle is keepalive_timeout between requests, write is the
+        # longest wait for the client to accept more of the response
+        self.timeouts = {'header': header_timeout, 'body': body_timeout, 'idle': keepalive_timeout,
+                         'write': write_timeout}
+        self.max_keepalive_requests = max_keepalive_requests
+        # Hot small files are answered from memory. cache_size=0 disables the cache
+        self.cache = None
+        if cache_size:
+            self.cache = FileCache(cache_size, cache_max_entry_size, cache_revalidate_interval)
+        # Range requests for files outside the cache are served from shared memory maps
+        self.mmaps = MmapRegistry()
+        # Text files are sent gzip/deflate encoded when the client accepts it
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self.compress_max_size = compress_max_size
+        self.compress_level = compress_level
+        self.compressed = CompressedCache(compression_cache_size)
+        # Validators and Cache-Control. max_age maps extensions to seconds and
+        # extends DEFAULT_MAX_AGE, None value disables the header for the extension
+        self.max_age = dict(self.DEFAULT_MAX_AGE, **(max_age or {}))
+        self.weak_etags = weak_etags
+        # Counters and phase timings of this process, served on metrics_path (None disables the endpoint).
+        # Per-connection log lines are sampled: one of log_every connections is logged
+        self.metrics = Metrics()
+        self.metrics_path = metrics_path
+        self.log_every = log_every
+        self.accepted = 0
+        # Access log file ('-' for stderr, None disables it). Opened by the serving process,
+        # pre-fork workers append their pid to the file name so rotation never races
+        self.access_log_path = access_log
+        self.access_log_options = {'log_format': access_log_format, 'max_bytes': access_log_max_bytes,
+                                   'backup_count': access_log_backups}
+        self.access_log = None
+
+        # Pre-fork settings. Children are tracked by the master process only
+        self.prefork = prefork
+        self.processes = processes or os.cpu_count() or 1
+        self.shutdown_timeout = shutdown_timeout
+        self.children = set()
+        self.is_child = False
+
+    def _create_socket(self):
+        """Creating listening socket"""
+        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.reuse_port:
+            listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        listen_socket.bind(self.address)
+        listen_socket.listen(self.backlog)
+        listen_socket.settimeout(self.socket_timeout)
+        return listen_socket
 
     @_process_logger(before='Waiting connections...')
     def launch(self):
         """Launching Python Server method"""
+        if self.warmup:
+            # Before fork, so worker processes share the warm caches
+            self._warm_up()
+        if self.prefork:
+            return self._launch_prefork()
+        return self._serve()
+
+    def _warm_up(self):
+        """Indexing DOCUMENT_ROOT and preloading small files, smallest first
+        while they fit in the cache, with their compressed variants"""
+        started = time.perf_counter()
+        index = self.resolver.build_index()
+        files = sorted((resolved for resolved in index.values() if resolved.exists),
+                       key=lambda resolved: resolved.stat.st_size)
+        preloaded = preloaded_bytes = 0
+        for resolved in files:
+            size = resolved.stat.st_size
+            if self.cache is None or size > min(self.warmup_max_size, self.cache.max_entry_size) or \
+                    preloaded_bytes + size > self.cache.max_bytes:
+                break
+            try:
+                entry = self.cache.get(resolved.path, resolved.content_type)
+                if self.compression and resolved.content_type in COMPRESSIBLE and size >= self.compress_min_size:
+                    self._encoded_body(resolved.path, entry.stat, entry, 'gzip', resolved.gzip)
+            except OSError:
+                continue
+            preloaded += 1
+            preloaded_bytes += size
+
+        self.warmup_stats = {
+            'files': len(files),
+            'bytes': sum(resolved.stat.st_size for resolved in files),
+            'preloaded_files': preloaded,
+            'preloaded_bytes': preloaded_bytes,
+            'seconds': time.perf_counter() - started,
+        }
+        logging.info('Indexed {files} files ({bytes} bytes), preloaded {preloaded_files} files '
+                     '({preloaded_bytes} bytes) in {seconds:.3f} s'.format(**self.warmup_stats))
+
+    def _serve(self):
+        """Serving connections in the current process"""
+        self._open_access_log()
+        # Tree changes are picked up off the serving path, per process (threads do not survive fork)
+        self.resolver.start()
+        try:
+            self._run_loop()
+        finally:
+            self.resolver.stop()
+            if self.access_log is not None:
+                self.access_log.stop()
+
+    def _run_loop(self):
+        """Serving loop of the configured mode"""
+        if self.mode == 'eventloop':
+            return self._launch_eventloop()
+        return self._launch_threaded()
+
+    def _open_access_log(self):
+        if self.access_log_path is None or self.access_log is not None:
+            return
+        path = self.access_log_path
+        if self.is_child and path != '-':
+            path = '{}.{}'.format(path, os.getpid())
+        self.access_log = AccessLog(path, **self.access_log_options)
+        self.access_log.start()
+
+    def _launch_threaded(self):
+        """Accepting connections for the pool of worker threads"""
+        pool = [Thread(target=self._worker_loop, daemon=True) for _ in range(self.workers)]
+        for worker in pool:
+            worker.start()
         try:
             while not self.__shutdown_request:
                 c_socket, c_address = self.socket.accept()
-                logging.info('Received connection from {}:{}'.format(c_address[0], c_address[1]))
+                self._log_connection(c_address)
 
                 try:
-                    worker = Thread(target=self._query_handler, args=(c_socket, ))
-                    worker.start()
-                except c_socket.error as se:
-                    logging.critical('Socket exception occurred.')
-                    logging.critical('{}'.format(se))
+                    self.accept_queue.put_nowait((c_socket, c_address, time.perf_counter()))
+                except queue.Full:
+                    self._reject(c_socket)
         except Exception as exc:
             logging.critical('Exception occurred. Shutting down.')
             logging.critical('{}'.format(exc))
             sys.exit()
         finally:
             self.socket.close()
+            # Queued connections are served before the workers see the stop marker
+            for _ in pool:
+                self.accept_queue.put(None)
+            for worker in pool:
+                worker.join()
+
+    def _launch_prefork(self):
+        """Master process: keeps `processes` worker processes alive until stop"""
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+        if self.reuse_port:
+            # Every child binds its own socket, the kernel balances between them
+            self.socket.close()
+        try:
+            while not self.__shutdown_request:
+                while len(self.children) < self.processes:
+                    self.children.add(self._spawn_child())
+                self._reap_children()
+                time.sleep(self.poll_interval)
+        finally:
+            self._terminate_children()
+            self.socket.close()
+
+    def _spawn_child(self):
+        """Forking worker process. Never returns in the child"""
+        pid = os.fork()
+        if pid:
+            logging.info('Started worker process {}'.format(pid))
+            return pid
+
+        self.is_child = True
+        self.children = set()
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        code = 0
+        try:
+            if self.reuse_port:
+                self.socket = self._create_socket()
+            self._serve()
+        except SystemExit:
+            pass
+        except BaseException as exc:
+            logging.critical('Worker process failed: {}'.format(exc))
+            code = 1
+        finally:
+            # os._exit skips atexit handlers
+            _stop_log_listener()
+            os._exit(code)
+
+    def _reap_children(self):
+        """Collecting exited workers so they are restarted on the next round"""
+        for pid in list(self.children):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done, status = pid, 0
+            if done:
+                self.children.discard(pid)
+                if not self.__shutdown_request:
+                    logging.warning('Worker process {} died (status {}). Restarting.'.format(pid, status))
+
+    def _terminate_children(self):
+        """Graceful shutdown of workers: SIGTERM, then SIGKILL after shutdown_timeout"""
+        for pid in self.children:
+            self._signal_child(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self.children and time.monotonic() < deadline:
+            self._reap_children()
+            time.sleep(0.05)
+        for pid in self.children:
+            logging.warning('Worker process {} did not stop in time. Killing.'.format(pid))
+            self._signal_child(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.children = set()
+
+    @staticmethod
+    def _signal_child(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _on_stop_signal(self, signum, frame):
+        self.stop()
+        if self.is_child and self.mode == 'threaded':
+            # accept() is restarted after signal handlers (PEP 475), so leave it explicitly.
+            # Pool workers still drain the accept queue in _serve
+            raise SystemExit(0)
+
+    @_process_logger(before='Starting worker...', after='Worker stopped.')
+    def _worker_loop(self):
+        """Pool worker. Handles connections from the accept queue until stop marker"""
+        while True:
+            item = self.accept_queue.get()
+            if item is None:
+                break
+            c_socket, c_address, accepted_at = item
+            self.metrics.observe('accept', time.perf_counter() - accepted_at)
+            try:
+                self._query_handler(c_socket, c_address)
+            except OSError as se:
+                logging.critical('Socket exception occurred.')
+                logging.critical('{}'.format(se))
+                c_socket.close()
+            except Exception:
+                # The worker goes on with the next connection
+                logging.exception('Unexpected error while serving {}. Closing the connection.'.format(c_address))
+                c_socket.close()
+
+    def _reject(self, client_socket):
+        """Fast path for saturated pool: answering 503 without reading the request"""
+        self.rejected += 1
+        logging.warning('Worker pool is saturated. Rejecting connection.')
+        response = BaseAnswer(503)
+        self._count_response(response)
+        try:
+            self._send_all(client_socket, response)
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+
+    def _launch_eventloop(self):
+        """Serving all connections from one thread with a selector (epoll on Linux)"""
+        selector = selectors.DefaultSelector()
+        timers = TimerHeap()
+        self.socket.setblocking(False)
+        selector.register(self.socket, selectors.EVENT_READ)
+        try:
+            while not self.__shutdown_request:
+                timeout = self.poll_interval
+                next_deadline = timers.next_deadline()
+                if next_deadline is not None:
+                    timeout = min(timeout, max(next_deadline - time.monotonic(), 0))
+                for key, mask in selector.select(timeout=timeout):
+                    if key.data is None:
+                        self._accept_connections(selector, timers)
+                    else:
+                        key.data.handle(mask)
+                for connection in timers.expired(time.monotonic()):
+                    try:
+                        connection.expire()
+                    except Exception:
+                        logging.exception('Unexpected error while expiring {}.'.format(connection.address))
+                        connection.close()
+        except Exception as exc:
+            logging.critical('Exception occurred. Shutting down.')
+            logging.critical('{}'.format(exc))
+            sys.exit()
+        finally:
+            for key in list(selector.get_map().values()):
+                if key.data is not None:
+                    key.data.close()
+            selector.close()
+            self.socket.close()
+
+    def _accept_connections(self, selector, timers):
+        """Accepting every pending connection from the listening socket"""
+        while True:
+            try:
+                c_socket, c_address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            c_socket.setblocking(False)
+            self._log_connection(c_address)
+            connection = _Connection(self, c_socket, c_address, selector, timers)
+            selector.register(c_socket, selectors.EVENT_READ, connection)
 
     @_process_logger(after='Shutting down.')
     def stop(self):
-        """Shutting down method"""
+        """Shutting down method. In pre-fork master also stops the worker processes"""
         self.__shutdown_request = True
 
-    @_process_logger(before='Starting worker...', after='Worker stopped.')
-    def _query_handler(self, client_socket):
-        """Handling process of receiving and sending data"""
-        request = self._receive_all(client_socket)
+    def _query_handler(self, client_socket, address=None):
+        """Handling process of receiving and sending data.
+        Serves requests over the same connection while keep-alive holds"""
+        parser = self._create_parser()
+        scratch = bytearray(self.chunk_size)
+        served = 0
+        self.metrics.connection_opened()
+        try:
+            keep_alive = True
+            while keep_alive:
+                request = self._receive_all(client_socket, parser, scratch, served)
+                if request is None:
+                    break
+                served += 1
+                keep_alive = self._keep_alive(request, served)
+                response = self._build_response(request, keep_alive=keep_alive)
+                send_started = time.perf_counter()
+                client_socket.settimeout(self.timeouts['write'])
+                self._send_all(client_socket, response)
+                self.metrics.observe('send', time.perf_counter() - send_started)
+                if self.access_log is not None:
+                    self.access_log.log(address, request, response)
+        except RequestError as error:
+            response = self._error_response(error)
+            self._send_all(client_socket, response)
+            if self.access_log is not None:
+                self.access_log.log(address, None, response)
+        except DeadlineExceeded as exc:
+            self.metrics.count_timeout(exc.phase)
+            if exc.phase != 'idle':
+                self._send_timeout_response(client_socket)
+        except socket.timeout:
+            self.metrics.count_timeout('write')
+            _reset_on_close(client_socket)
+        finally:
+            self.metrics.connection_closed()
+            client_socket.close()
+
+    def _create_parser(self):
+        return RequestParser(self.max_header_bytes, self.max_body_bytes)
+
+    def _keep_alive(self, request, served):
+        """Whether the connection stays open after answering the request"""
+        if served >= self.max_keepalive_requests:
+            return False
+        connection = request.headers.get('connection', '').lower()
+        if request.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def _error_response(self, error):
+        """Answer for a request the parser rejected. The connection is closed after it"""
+        logging.warning('Bad request: {}'.format(error))
+        response = BaseAnswer(error.status, headers={'Connection': 'close'})
+        self._count_response(response)
+        return response
+
+    def _build_response(self, request, keep_alive=False):
+        """Creating response for the parsed request"""
+        response = self._route_response(request, keep_alive)
+        self._count_response(response)
+        return response
 
-        path = self._parse_filepath(request=request)
+    def _route_response(self, request, keep_alive):
+        headers = {'Connection': 'keep-alive' if keep_alive else 'close'}
+        if self.metrics_path is not None and request.path == self.metrics_path:
+            return self._metrics_answer(request, headers)
+        if request.method not in ('GET', 'HEAD'):
+            return BaseAnswer(405, headers=headers)
         try:
-            try:
-                with open(self.DOCUMENT_ROOT + path, 'r') as f:
-                    content = f.read()
-            except UnicodeDecodeError:
-                with open(self.DOCUMENT_ROOT + path, 'rb') as f:
-                    content = f.read()
-            f.close()
-            content_type = (re.search('\.(\w+)$', path).group(0)[1:]).lower()
-
-            if re.match('GET', request):
-                response = BaseAnswer(200, content_type=content_type, content=content)
-            elif re.match('HEAD', request):
-                response = BaseAnswer(200, content_type=content_type, content=content, header_only=True)
-            else:
-                response = BaseAnswer(405)
+            resolved = self.resolver.resolve(request.path)
+            if not resolved.exists:
+                return BaseAnswer(resolved.status, headers=headers)
+            response = self._file_answer(resolved.path, resolved.content_type, request.headers,
+                                         header_only=request.method == 'HEAD', headers=headers,
+                                         gzip_sibling=resolved.gzip)
         except FileNotFoundError:
-            response = BaseAnswer(404)
+            response = BaseAnswer(404, headers=headers)
         except Exception as e:
-            response = BaseAnswer(500)
+            response = BaseAnswer(500, headers=headers)
+        return response
+
+    def _file_answer(self, file_path, content_type, request_headers, header_only=False, headers=None,
+                     gzip_sibling=None):
+        """Answer for a static file: from the cache when possible, streamed from disk otherwise.
+        Answers 304 when the client copy is still valid. Range requests are answered
+        with 206 (or 416) unless If-Range no longer matches"""
+        entry = None
+        stat_started = time.perf_counter()
+        try:
+            if self.cache is not None:
+                entry = self.cache.get(file_path, content_type)
+                file_stat = entry.stat
+            else:
+                file_stat = os.stat(file_path)
+                if not stat.S_ISREG(file_stat.st_mode):
+                    raise FileNotFoundError(file_path)
+        finally:
+            self.metrics.observe('stat', time.perf_counter() - stat_started)
+        headers['Accept-Ranges'] = 'bytes'
+        headers['Last-Modified'] = http_date(file_stat.st_mtime)
+        if self.max_age.get(content_type) is not None:
+            headers['Cache-Control'] = 'max-age={}'.format(self.max_age[content_type])
+        if content_type in COMPRESSIBLE:
+            headers['Vary'] = 'Accept-Encoding'
+
+        range_header = request_headers.get('range')
+        use_range = range_header and not header_only and \
+            if_range_matches(request_headers.get('if-range'), file_stat)
+        encoded = None
+        if not use_range and self.compression and content_type in COMPRESSIBLE and \
+                file_stat.st_size >= self.compress_min_size:
+            coding = negotiate(request_headers.get('accept-encoding'))
+            if coding is not None:
+                encoded = self._encoded_body(file_path, file_stat, entry, coding, gzip_sibling)
+
+        headers['ETag'] = entity_tag(file_stat, encoded and encoded[0], weak=self.weak_etags)
+        if self._not_modified(request_headers, file_stat, headers['ETag']):
+            return BaseAnswer(304, headers=headers)
 
-        # Sending response and closing socket
-        self._send_all(client_socket, response)
-        client_socket.close()
+        if use_range:
+            if entry is not None and entry.body is not None:
+                data = memoryview(entry.body)
+            else:
+                data = self.mmaps.get(file_path, file_stat)
+            try:
+                ranges = parse_range(range_header, len(data))
+            except RangeNotSatisfiable:
+                headers['Content-Range'] = 'bytes */{}'.format(len(data))
+                return BaseAnswer(416, headers=headers)
+            if ranges:
+                return RangeAnswer(data, ranges, content_type=content_type, headers=headers)
+
+        if encoded is not None:
+            coding, source = encoded
+            headers['Content-Encoding'] = coding
+            if isinstance(source, bytes):
+                return BaseAnswer(200, content_type=content_type, content=source, header_only=header_only,
+                                  headers=headers)
+            return FileAnswer(file_path + '.gz', source.st_size, 200, content_type=content_type,
+                              header_only=header_only, headers=headers)
+
+        if entry is not None and entry.body is not None:
+            return CachedAnswer(entry, 200, header_only=header_only, headers=headers)
+        return FileAnswer(file_path, file_stat.st_size, 200, content_type=content_type,
+                          header_only=header_only, headers=headers)
 
-    def _receive_all(self, client_socket):
-        """Receive data string method"""
-        data = ''
+    def _metrics_answer(self, request, headers):
+        """Prometheus text exposition of this process counters"""
+        if request.method not in ('GET', 'HEAD'):
+            return BaseAnswer(405, headers=headers)
+        extra = [('pyserver_rejected_total', 'counter', 'Connections rejected with 503 by saturated pool.',
+                  [((), self.rejected)])]
+        caches = [('file', self.cache), ('compressed', self.compressed), ('path', self.resolver)]
+        stats = [(cache_name, cache.stats()) for cache_name, cache in caches if cache is not None]
+        for name in ('hits', 'misses', 'evictions', 'invalidations'):
+            extra.append(('pyserver_cache_{}_total'.format(name), 'counter', 'Cache {}.'.format(name),
+                          [((('cache', cache_name), ), values[name]) for cache_name, values in stats]))
+        extra.append(('pyserver_cache_entries', 'gauge', 'Entries held by the cache.',
+                      [((('cache', cache_name), ), values['entries']) for cache_name, values in stats]))
+        extra.append(('pyserver_cache_bytes', 'gauge', 'Bytes held by the cache.',
+                      [((('cache', cache_name), ), values['bytes']) for cache_name, values in stats
+                       if 'bytes' in values]))
+        if self.warmup_stats is not None:
+            extra.append(('pyserver_warmup_seconds', 'gauge', 'Startup indexing and preloading time.',
+                          [((), self.warmup_stats['seconds'])]))
+            extra.append(('pyserver_warmup_files', 'gauge', 'Files indexed and preloaded at startup.',
+                          [((('stage', 'indexed'), ), self.warmup_stats['files']),
+                           ((('stage', 'preloaded'), ), self.warmup_stats['preloaded_files'])]))
+        if self.access_log is not None:
+            extra.append(('pyserver_access_log_lines_total', 'counter', 'Access log lines by outcome.',
+                          [((('outcome', 'written'), ), self.access_log.written),
+                           ((('outcome', 'dropped'), ), self.access_log.dropped)]))
+        headers['Cache-Control'] = 'no-store'
+        return BaseAnswer(200, content_type='txt', content=self.metrics.render(extra),
+                          header_only=request.method == 'HEAD', headers=headers)
+
+    def _count_response(self, response):
+        sent_bytes = len(response.head())
+        if not response.header_only:
+            sent_bytes += response.content_length()
+        self.metrics.count_response(response.status, response.content_type, sent_bytes)
+
+    def _log_connection(self, address):
+        """Sampled connection log, every log_every-th connection"""
+        self.accepted += 1
+        if self.log_every and self.accepted % self.log_every == 1 % self.log_every:
+            logging.info('Received connection from {}:{} ({} so far)'.format(address[0], address[1], self.accepted))
+
+    def _encoded_body(self, file_path, file_stat, entry, coding, gzip_sibling=None):
+        """Compressed variant of the file: (coding, stat of precompressed .gz sibling)
+        or (coding, compressed bytes). None when the file should be sent as is.
+        gzip_sibling=False skips looking for the sibling (the index knows there is none)"""
+        if coding == 'gzip' and gzip_sibling is not False:
+            try:
+                sibling_stat = os.stat(file_path + '.gz')
+            except OSError:
+                sibling_stat = None
+            # A sibling older than the file is stale
+            if sibling_stat is not None and stat.S_ISREG(sibling_stat.st_mode) and \
+                    sibling_stat.st_mtime_ns >= file_stat.st_mtime_ns:
+                return coding, sibling_stat
+
+        if file_stat.st_size > self.compress_max_size:
+            return None
+        body = self.compressed.get(file_path, file_stat, coding)
+        if body is None:
+            if entry is not None and entry.body is not None:
+                raw = entry.body
+            else:
+                with open(file_path, 'rb') as f:
+                    raw = f.read()
+            body = compress(raw, coding, self.compress_level)
+            self.compressed.put(file_path, file_stat, coding, body)
+        if len(body) >= file_stat.st_size:
+            return None
+        return coding, body
+
+    @staticmethod
+    def _not_modified(request_headers, file_stat, etag):
+        """Evaluating If-None-Match (takes precedence) and If-Modified-Since"""
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is not None:
+            if if_none_match.strip() == '*':
+                return True
+            # Weak comparison: W/ prefix is ignored
+            opaque_tag = etag[2:] if etag.startswith('W/') else etag
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                if (tag[2:] if tag.startswith('W/') else tag) == opaque_tag:
+                    return True
+            return False
+
+        if_modified_since = parse_http_date(request_headers.get('if-modified-since'))
+        return if_modified_since is not None and int(file_stat.st_mtime) <= if_modified_since
+
+    def _receive_all(self, client_socket, parser, scratch, served=0):
+        """Receive data method. Returns the next parsed request from the stream,
+        None when the client closed the connection between requests.
+        Raises DeadlineExceeded when the phase deadline passes"""
+        # Pipelined bytes of the request are in the parser already
+        read_started = time.perf_counter() if parser.has_data() else None
+        phase = deadline = None
         while True:
-            data += client_socket.recv(self.chunk_size).decode('utf-8')
-            if self.terminator in data:
-                break
-        return data[:-4]
+            parse_started = time.perf_counter()
+            request = parser.next_request()
+            if request is not None:
+                self.metrics.observe('parse', time.perf_counter() - parse_started)
+                self.metrics.observe('read', parse_started - read_started)
+                return request
+
+            current = self._read_phase(parser, 'idle' if served else 'header')
+            if current != phase:
+                phase, deadline = current, time.monotonic() + self.timeouts[current]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(phase)
+            client_socket.settimeout(remaining)
+            try:
+                received = client_socket.recv_into(scratch)
+            except socket.timeout:
+                raise DeadlineExceeded(phase)
+            if read_started is None:
+                read_started = time.perf_counter()
+            if not received:
+                if parser.has_data():
+                    # Peer closed the connection before finishing the request
+                    raise ConnectionResetError('Connection closed by client')
+                return None
+            with memoryview(scratch) as view:
+                parser.feed(view[:received])
 
     @staticmethod
-    def _send_all(client_socket, message):
-        """Send data string method"""
-        client_socket.sendall(message.head())
-        if not message.header_only:
-            client_socket.sendall(message.body())
+    def _read_phase(parser, waiting='idle'):
+        """Deadline kind while reading. `waiting` is the phase before the first byte"""
+        if parser.reading_body:
+            return 'body'
+        return 'header' if parser.has_data() else waiting
+
+    def _timeout_response(self):
+        response = BaseAnswer(408, headers={'Connection': 'close'})
+        self._count_response(response)
+        return response
+
+    def _send_timeout_response(self, client_socket):
+        """Best effort 408 for a client too slow to send its request"""
+        try:
+            client_socket.settimeout(0)
+            client_socket.send(self._timeout_response().head())
+        except OSError:
+            pass
 
     @staticmethod
-    def _parse_filepath(request):
-        # Parsing request and creating response
-        request_splitted = re.split('\s|\n', request)
-
-        # Defining file path
-        path = request_splitted[1]
-        if path == '//' or path == '/':
-            path = '/index.html'
-        # Replacing spaces
-        path = re.sub('%20', ' ', path)
-        return path
+    def _send_all(client_socket, message):
+        """Send data method. Head and in-memory body are sent with one sendmsg call"""
+        buffers = deque([memoryview(message.head())])
+        send_file = isinstance(message, FileAnswer) and not message.header_only and message.size
+        if not message.header_only and not isinstance(message, FileAnswer):
+            buffers.extend(memoryview(part) for part in message.parts() if len(part))
+
+        flags = _MSG_MORE if send_file else 0
+        while buffers:
+            _advance(buffers, _send_buffers(client_socket, list(islice(buffers, _IOV_BATCH)), flags))
+        if send_file:
+            # os.sendfile where available, chunked send() otherwise
+            with open(message.path, 'rb') as f:
+                client_socket.sendfile(f, 0, message.size)
 
 
 if __name__ == '__main__':
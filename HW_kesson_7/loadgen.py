@@ -0,0 +1,190 @@
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+from threading import Thread
+from HW_kesson_7.client import PyServerClient
+from HW_kesson_7 import reqresp as rr
+
+
+class LatencyHistogram:
+    """HDR-style latency histogram over integer microseconds.
+
+    Values below 2 ** precision_bits are counted exactly, bigger ones keep
+    their top precision_bits bits, so relative error stays below
+    2 ** (1 - precision_bits) (under 1% by default) with few buckets"""
+    def __init__(self, precision_bits=8):
+        self.precision_bits = precision_bits
+        self.counts = {}
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, value):
+        value = int(value)
+        shift = max(value.bit_length() - self.precision_bits, 0)
+        bucket = (value >> shift) << shift
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Highest value equivalent to the bucket holding the percentile"""
+        if not self.total:
+            return 0
+        rank = max(int(round(percent / 100. * self.total)), 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                shift = max(bucket.bit_length() - self.precision_bits, 0)
+                return min(bucket + (1 << shift) - 1, self.max)
+        return self.max
+
+    def summary(self):
+        """Latency report in milliseconds"""
+        report = {'p{}'.format(name): self.percentile(percent) / 1000.
+                  for name, percent in (('50', 50), ('90', 90), ('99', 99), ('999', 99.9))}
+        report['mean'] = self.sum / self.total / 1000. if self.total else 0.
+        report['max'] = self.max / 1000.
+        return report
+
+
+class LoadGenerator:
+    """Load generator over a pool of persistent PyServerClient connections.
+
+    `mix` is a list of (method, path, weight) tuples, method is 'GET' or 'HEAD'.
+    With `rps` every connection sends on a fixed schedule (open loop) and
+    latency is counted from the scheduled send time, so a stalled server is
+    not hidden by the generator waiting for it. Without `rps` every connection
+    sends the next request as soon as the previous answer arrives, which keeps
+    concurrency equal to `connections`"""
+    request_types = {'GET': rr.GetRequest, 'HEAD': rr.HeadRequest}
+
+    def __init__(self, host='127.0.0.1', port=8080, mix=(('GET', '/', 1), ), connections=8, duration=10.,
+                 rps=None, timeout=5., seed=None):
+        self.host = host
+        self.port = port
+        self.mix = mix
+        self.connections = connections
+        self.duration = duration
+        self.rps = rps
+        self.timeout = timeout
+        self.seed = seed
+
+    def run(self):
+        """Running the load and returning the report dict"""
+        results = [None] * self.connections
+        workers = [Thread(target=self._worker, args=(number, results), daemon=True)
+                   for number in range(self.connections)]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+
+        histogram = LatencyHistogram()
+        statuses = {}
+        errors = 0
+        for worker_histogram, worker_statuses, worker_errors in results:
+            histogram.merge(worker_histogram)
+            errors += worker_errors
+            for status, count in worker_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+        return {
+            'connections': self.connections,
+            'target_rps': self.rps,
+            'duration': elapsed,
+            'requests': histogram.total,
+            'errors': errors,
+            'throughput': histogram.total / elapsed if elapsed else 0.,
+            'statuses': statuses,
+            'latency_ms': histogram.summary(),
+        }
+
+    def _worker(self, number, results):
+        histogram = LatencyHistogram()
+        statuses = {}
+        errors = 0
+        rand = random.Random(None if self.seed is None else self.seed + number)
+        methods, paths, weights = zip(*self.mix)
+        interval = self.connections / self.rps if self.rps else 0.
+
+        client = PyServerClient(timeout=self.timeout)
+        client.chunk_size = 65536
+        try:
+            client.connect(self.host, self.port)
+        except Exception:
+            results[number] = (histogram, statuses, 1)
+            return
+
+        started = time.monotonic()
+        deadline = started + self.duration
+        # Spreading connections over the first interval
+        scheduled = started + interval * rand.random()
+        while True:
+            now = time.monotonic()
+            if interval:
+                if scheduled > now:
+                    time.sleep(scheduled - now)
+                start = scheduled
+                scheduled += interval
+            else:
+                start = now
+            if start >= deadline:
+                break
+
+            choice = rand.choices(range(len(paths)), weights)[0]
+            request = self.request_types[methods[choice]](self.host, body=paths[choice])
+            try:
+                head = client.request(request)
+            except (OSError, ValueError):
+                errors += 1
+                continue
+            histogram.record((time.monotonic() - start) * 1e6)
+            status = head.split(' ', 2)[1] if head else '-'
+            statuses[status] = statuses.get(status, 0) + 1
+        client.close_connection()
+        results[number] = (histogram, statuses, errors)
+
+
+def _mix_item(value):
+    """Parsing [METHOD:]PATH[@WEIGHT], e.g. /index.html@9 or HEAD:/big.jpg@1"""
+    method, _, rest = value.partition(':') if value.startswith(('GET:', 'HEAD:')) else ('GET', '', value)
+    path, _, weight = rest.partition('@')
+    return method, path, float(weight or 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='PyServer load generator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--connections', type=int, default=8, help='persistent connections (concurrency)')
+    parser.add_argument('--duration', type=float, default=10., help='seconds')
+    parser.add_argument('--rps', type=float, default=None, help='target requests per second (open loop)')
+    parser.add_argument('--request', dest='mix', type=_mix_item, action='append',
+                        help='[GET:|HEAD:]PATH[@WEIGHT], may be repeated')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    # Per-request client logging would measure the logger instead of the server
+    logging.getLogger().setLevel(logging.WARNING)
+    generator = LoadGenerator(args.host, args.port, mix=args.mix or [('GET', '/', 1)],
+                              connections=args.connections, duration=args.duration, rps=args.rps, seed=args.seed)
+    json.dump(generator.run(), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+from bisect import bisect_left
+from threading import Lock
+
+
+# Upper bounds of the phase timing buckets, seconds
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense. Not locked by itself"""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        """(name, labels, value) lines of the histogram"""
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'), ), self.counts):
+            seen += count
+            yield name + '_bucket', labels + (('le', '+Inf' if bound == float('inf') else repr(bound)), ), seen
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, self.count
+
+
+class Metrics:
+    """Counters of one server process, rendered in Prometheus text format.
+
+    Phases: accept (accept queue wait in threaded mode), read (from the first
+    bytes of a request to the complete request), parse, stat (cache lookup or
+    stat of the file), send (writing responses to the socket).
+    All updates take one short lock, there is no I/O on the serving path"""
+    PHASES = ('accept', 'read', 'parse', 'stat', 'send')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.phases = {phase: Histogram() for phase in self.PHASES}
+        self.responses = {}
+        self.bytes_out = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.timeouts = {}
+
+    def observe(self, phase, seconds):
+        with self.lock:
+            self.phases[phase].observe(seconds)
+
+    def count_response(self, status, content_type, sent_bytes):
+        key = (status, content_type or '')
+        with self.lock:
+            self.responses[key] = self.responses.get(key, 0) + 1
+            self.bytes_out += sent_bytes
+
+    def count_timeout(self, phase):
+        with self.lock:
+            self.timeouts[phase] = self.timeouts.get(phase, 0) + 1
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections += 1
+            self.in_flight += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def render(self, extra=()):
+        """Prometheus text exposition. `extra` is an iterable of
+        (name, type, help, [(labels, value), ...]) families"""
+        with self.lock:
+            families = [
+                ('pyserver_responses_total', 'counter', 'Responses by status code and content type.',
+                 [((('status', str(status)), ('content_type', content_type)), count)
+                  for (status, content_type), count in sorted(self.responses.items())]),
+                ('pyserver_bytes_out_total', 'counter', 'Response bytes (heads and bodies).',
+                 [((), self.bytes_out)]),
+                ('pyserver_connections_total', 'counter', 'Accepted connections.', [((), self.connections)]),
+                ('pyserver_connections_in_flight', 'gauge', 'Connections being served.', [((), self.in_flight)]),
+                ('pyserver_timeouts_total', 'counter', 'Connections closed by a deadline, by phase.',
+                 [((('phase', phase), ), count) for phase, count in sorted(self.timeouts.items())]),
+            ]
+            phases = [sample for phase in self.PHASES
+                      for sample in self.phases[phase].samples('pyserver_phase_seconds', (('phase', phase), ))]
+
+        lines = []
+        for name, kind, description, samples in list(families) + list(extra):
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            lines.extend(_sample(name, labels, value) for labels, value in samples)
+        lines.append('# HELP pyserver_phase_seconds Time spent in request phases.')
+        lines.append('# TYPE pyserver_phase_seconds histogram')
+        lines.extend(_sample(name, labels, value) for name, labels, value in phases)
+        return '\n'.join(lines) + '\n'
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join('{}="{}"'.format(label, _escape(str(text))) for label, text in labels) + '}'
+    return '{} {}'.format(name, value)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
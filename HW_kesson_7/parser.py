@@ -0,0 +1,185 @@
+class RequestError(Exception):
+    """Malformed or unsupported request. `status` is the status code to answer with"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class HttpRequest:
+    """Parsed HTTP request. Header names are lower-cased"""
+    def __init__(self, method, target, version, headers, body=b''):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    def __str__(self):
+        return '{} {} {}'.format(self.method, self.target, self.version)
+
+    @property
+    def path(self):
+        """Request target without query string"""
+        return self.target.partition('?')[0]
+
+    @property
+    def content_length(self):
+        value = self.headers.get('content-length')
+        if value is None:
+            return 0
+        # Headers are decoded as Latin-1, where isdigit() alone also passes '²'
+        if not (value.isascii() and value.isdigit()):
+            raise RequestError(400, 'Bad Content-Length "{}"'.format(value))
+        return int(value)
+
+
+class RequestParser:
+    """Incremental bytes-level request parser.
+
+    Received data is appended with feed(), complete requests are taken with
+    next_request(). The head is searched for the terminator only in the new
+    data, parsed once, then the body is collected by Content-Length or
+    decoded from Transfer-Encoding: chunked as chunks arrive.
+    Pipelined requests stay in the buffer until asked for"""
+    terminator = b'\r\n\r\n'
+    # Longest chunk size line (size and extensions)
+    max_chunk_line = 1024
+    # States of chunked body decoding besides the number of chunk data bytes left
+    CHUNK_SIZE, CHUNK_END, TRAILERS = -1, -2, -3
+
+    def __init__(self, max_header_bytes=8192, max_body_bytes=1024 * 1024):
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+        self.buffer = bytearray()
+        self.scan_from = 0
+        # Request whose head is parsed and body is still incomplete
+        self.pending = None
+        # Decoded body and decoder state of a chunked request
+        self.chunked_body = None
+        self.chunk_state = self.CHUNK_SIZE
+        self.trailer_bytes = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def has_data(self):
+        """Whether a started request is waiting for more data"""
+        return bool(self.buffer) or self.pending is not None
+
+    @property
+    def reading_body(self):
+        """Whether the head of the started request is parsed and the body is incomplete"""
+        return self.pending is not None
+
+    def next_request(self):
+        """Returning next complete request or None if more data is needed.
+        Raises RequestError for requests that can not be served"""
+        if self.pending is None:
+            end = self.buffer.find(self.terminator, self.scan_from)
+            if end < 0:
+                if len(self.buffer) > self.max_header_bytes:
+                    raise RequestError(431, 'Request header is too large')
+                # Terminator may be split between this and next chunk
+                self.scan_from = max(len(self.buffer) - len(self.terminator) + 1, 0)
+                return None
+            if end > self.max_header_bytes:
+                raise RequestError(431, 'Request header is too large')
+
+            with memoryview(self.buffer) as view:
+                self.pending = self._parse_head(view[:end])
+            del self.buffer[:end + len(self.terminator)]
+            self.scan_from = 0
+            transfer_encoding = self.pending.headers.get('transfer-encoding')
+            if transfer_encoding is not None:
+                if transfer_encoding.strip().lower() != 'chunked':
+                    raise RequestError(501, 'Transfer-Encoding "{}" is not supported'.format(transfer_encoding))
+                if 'content-length' in self.pending.headers:
+                    # Ambiguous framing, the way to request smuggling
+                    raise RequestError(400, 'Both Content-Length and Transfer-Encoding')
+                self.chunked_body = bytearray()
+                self.chunk_state = self.CHUNK_SIZE
+                self.trailer_bytes = 0
+            elif self.pending.content_length > self.max_body_bytes:
+                raise RequestError(413, 'Request body is too large')
+
+        if self.chunked_body is not None:
+            if not self._decode_chunks():
+                return None
+            request, self.pending = self.pending, None
+            request.body, self.chunked_body = bytes(self.chunked_body), None
+            return request
+
+        length = self.pending.content_length
+        if len(self.buffer) < length:
+            return None
+        request, self.pending = self.pending, None
+        if length:
+            request.body = bytes(self.buffer[:length])
+            del self.buffer[:length]
+        return request
+
+    def _decode_chunks(self):
+        """Moving chunk data from the buffer to chunked_body.
+        True when the last chunk and the trailers are read"""
+        buffer = self.buffer
+        while True:
+            state = self.chunk_state
+            if state >= 0:
+                # Chunk data
+                taken = min(state, len(buffer))
+                self.chunked_body += buffer[:taken]
+                del buffer[:taken]
+                self.chunk_state = state - taken
+                if self.chunk_state:
+                    return False
+                self.chunk_state = self.CHUNK_END
+            elif state == self.CHUNK_END:
+                if len(buffer) < 2:
+                    return False
+                if buffer[:2] != b'\r\n':
+                    raise RequestError(400, 'Bad chunk end')
+                del buffer[:2]
+                self.chunk_state = self.CHUNK_SIZE
+            else:
+                end = buffer.find(b'\n')
+                if end < 0:
+                    if len(buffer) > self.max_chunk_line:
+                        raise RequestError(400, 'Chunk size line is too long')
+                    return False
+                line = bytes(buffer[:end]).rstrip(b'\r')
+                del buffer[:end + 1]
+                if state == self.TRAILERS:
+                    if not line:
+                        return True
+                    # Trailer fields are not used, only limited like the head
+                    self.trailer_bytes += len(line)
+                    if self.trailer_bytes > self.max_header_bytes:
+                        raise RequestError(431, 'Request trailers are too large')
+                    continue
+                size = line.partition(b';')[0].strip()
+                if not size or size.strip(b'0123456789abcdefABCDEF'):
+                    raise RequestError(400, 'Bad chunk size')
+                size = int(size, 16)
+                if len(self.chunked_body) + size > self.max_body_bytes:
+                    raise RequestError(413, 'Request body is too large')
+                self.chunk_state = size if size else self.TRAILERS
+
+    @staticmethod
+    def _parse_head(head):
+        """Parsing request line and headers. Lines may end with CRLF or bare LF"""
+        lines = head.tobytes().split(b'\n')
+        request_line = lines[0].rstrip(b'\r').split()
+        if len(request_line) != 3 or not request_line[2].startswith(b'HTTP/'):
+            raise RequestError(400, 'Bad request line')
+        method, target, version = request_line
+
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.rstrip(b'\r').partition(b':')
+            if not sep or not name or name != name.strip():
+                raise RequestError(400, 'Bad header line')
+            name = name.decode('latin-1').lower()
+            value = value.strip().decode('latin-1')
+            headers[name] = headers[name] + ', ' + value if name in headers else value
+        return HttpRequest(method.decode('ascii', 'replace'), target.decode('utf-8', 'replace'),
+                           version.decode('ascii', 'replace'), headers)
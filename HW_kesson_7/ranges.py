@@ -0,0 +1,108 @@
+import os
+import mmap
+from threading import Lock
+from collections import OrderedDict
+from HW_kesson_7.reqresp import entity_tag, parse_http_date
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlaps the file"""
+
+
+def parse_range(header, size, max_ranges=32):
+    """Parsing Range header value into sorted list of (first, last) byte positions.
+    Overlapping and adjacent ranges are merged. Returns None when the header
+    has to be ignored (other unit, bad syntax, too many ranges).
+    Raises RangeNotSatisfiable when no range fits into `size` bytes"""
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    items = [item.strip() for item in spec.split(',') if item.strip()]
+    if not items or len(items) > max_ranges:
+        return None
+
+    ranges = []
+    for item in items:
+        first, sep, last = item.partition('-')
+        first, last = first.strip(), last.strip()
+        # ASCII only: the header is decoded as Latin-1, where '²' is a digit to isdigit()
+        if not sep or (first and not _is_number(first)) or (last and not _is_number(last)):
+            return None
+        if not first:
+            # Suffix range: last N bytes
+            if not last:
+                return None
+            if not int(last):
+                continue
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = min(int(last), size - 1) if last else size - 1
+        if start >= size:
+            continue
+        ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable(header)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _is_number(value):
+    return value.isascii() and value.isdigit()
+
+
+def if_range_matches(if_range, file_stat):
+    """Whether Range may be applied: If-Range is absent or still matches the file"""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        # Only strong entity tags are allowed here
+        return if_range == entity_tag(file_stat)
+    return parse_http_date(if_range) == int(file_stat.st_mtime)
+
+
+class MmapRegistry:
+    """Read-only memory maps of files shared by all handler threads.
+    Maps are reopened when the file changes and dropped in LRU order.
+    Dropped maps stay alive while responses still hold slices of them"""
+    def __init__(self, max_maps=64):
+        self.max_maps = max_maps
+        self.maps = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, path, file_stat):
+        """Returning memoryview over the whole file"""
+        identity = (file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+        with self.lock:
+            cached = self.maps.get(path)
+            if cached is not None and cached[0] == identity:
+                self.maps.move_to_end(path)
+                return cached[1]
+
+        if not file_stat.st_size:
+            # Empty files can not be mapped
+            return memoryview(b'')
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            view = memoryview(mmap.mmap(fd, 0, access=mmap.ACCESS_READ))
+        finally:
+            os.close(fd)
+
+        with self.lock:
+            self.maps[path] = (identity, view)
+            self.maps.move_to_end(path)
+            while len(self.maps) > self.max_maps:
+                self.maps.popitem(last=False)
+        return view
@@ -1,69 +1,269 @@
-from datetime import datetime
+import time
+import uuid
+from types import MappingProxyType
+from email.utils import formatdate, parsedate_to_datetime
+
+
+def entity_tag(file_stat, coding=None, weak=False):
+    """Entity tag of a file version: inode, size and mtime.
+    Encoded variants of the file get the content coding appended"""
+    tag = '{:x}-{:x}-{:x}'.format(file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+    if coding:
+        tag += '-' + coding
+    return '{}"{}"'.format('W/' if weak else '', tag)
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value):
+    """Timestamp of an HTTP-date or None when it can not be parsed"""
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+# (second, encoded Date header line). Replaced as a whole, so threads never see a torn value
+_date_line = (0, b'')
+
+
+def date_header():
+    """Date header line. Formatted at most once per second and shared by all threads"""
+    global _date_line
+    now = int(time.time())
+    second, line = _date_line
+    if second != now:
+        line = 'Date: {}\r\n'.format(http_date(now)).encode('ascii')
+        _date_line = (now, line)
+    return line
 
 
 # Answers
 class BaseAnswer:
-    def __init__(self, status_code=200, content_type=None, content=None, header_only=False):
-        self._date_format = '%a, %d %b %Y %H:%M:%S GMT'
-        self._terminator = '\r\n\r\n'
-        self.statuses = {
-            200: 'HTTP/1.1 200 OK',
-            404: 'HTTP/1.1 404 Not Found',
-            405: 'HTTP/1.1 405 Method Not Allowed',
-            500: 'HTTP/1.1 500 Internal Server Error'
-        }
-        self.content_types = {
-            'txt': 'text/plain',
-            'html': 'text/html',
-            'css': 'text/css',
-            'js': 'text/javascript"',
-            'jpg': 'image/jpeg',
-            'jpeg': 'image/jpeg',
-            'png': 'image/png',
-            'gif': 'image/gif',
-            'swf': 'application/x-shockwave-flash'
-        }
+    __slots__ = ('status', 'content_type', 'content', 'header_only', 'headers', '_body', 'header')
+
+    statuses = MappingProxyType({
+        200: 'HTTP/1.1 200 OK',
+        206: 'HTTP/1.1 206 Partial Content',
+        304: 'HTTP/1.1 304 Not Modified',
+        400: 'HTTP/1.1 400 Bad Request',
+        403: 'HTTP/1.1 403 Forbidden',
+        404: 'HTTP/1.1 404 Not Found',
+        405: 'HTTP/1.1 405 Method Not Allowed',
+        408: 'HTTP/1.1 408 Request Timeout',
+        413: 'HTTP/1.1 413 Payload Too Large',
+        416: 'HTTP/1.1 416 Range Not Satisfiable',
+        431: 'HTTP/1.1 431 Request Header Fields Too Large',
+        500: 'HTTP/1.1 500 Internal Server Error',
+        501: 'HTTP/1.1 501 Not Implemented',
+        503: 'HTTP/1.1 503 Service Unavailable'
+    })
+    content_types = MappingProxyType({
+        'txt': 'text/plain',
+        'html': 'text/html',
+        'htm': 'text/html',
+        'css': 'text/css',
+        'js': 'text/javascript',
+        'json': 'application/json',
+        'xml': 'application/xml',
+        'svg': 'image/svg+xml',
+        'jpg': 'image/jpeg',
+        'jpeg': 'image/jpeg',
+        'png': 'image/png',
+        'gif': 'image/gif',
+        'ico': 'image/x-icon',
+        'pdf': 'application/pdf',
+        'swf': 'application/x-shockwave-flash',
+        'bin': 'application/octet-stream'
+    })
+    server = 'PyServer'
+
+    # Pre-encoded pieces of the head
+    _status_lines = MappingProxyType({
+        code: '{}\r\n'.format(line).encode('ascii') for code, line in statuses.items()})
+    _content_type_lines = MappingProxyType({
+        extension: 'Content-Type: {}\r\n'.format(mime).encode('ascii') for extension, mime in content_types.items()})
+    _server_line = 'Server: {}\r\n'.format(server).encode('ascii')
 
+    def __init__(self, status_code=200, content_type=None, content=None, header_only=False, headers=None):
         self.status = status_code
-        self.server = 'PyServer'
         self.content_type = content_type
         self.content = content
         self.header_only = header_only
+        self.headers = headers or {}
+        self._body = self._encode(content)
 
-        self.header = ''
+        self.header = b''
         self.update()
 
     def update(self):
-        self.header = ''
         if self.status:
-            self.header += self.statuses[self.status]
+            status_line = self._status_lines[self.status]
         else:
             raise Exception('Define status line')
 
-        self.header += '\nDate : {}'.format(datetime.utcnow().strftime(self._date_format))
-        self.header += '\nServer : {}'.format(self.server)
+        extra = ''.join('{}: {}\r\n'.format(name, value) for name, value in self.headers.items())
+        self.header = b''.join((status_line, date_header(), self._server_line, self.entity_headers(),
+                                extra.encode('latin-1'), b'\r\n'))
 
-        if self.content:
+    def entity_headers(self):
+        """Content-Type and Content-Length header lines"""
+        if self.status == 304:
+            # Not Modified describes the cached representation, it has no body of its own
+            return b''
+        content_length = self.content_length()
+        content_type_line = b''
+        if content_length:
             if not self.content_type:
                 raise Exception('Define content-type and content-length')
-            self.header += '\nContent-type : {}'.format(self.content_types[self.content_type])
-            self.header += '\nContent-length : {}'.format(len(self.content))
-
-        self.header += self._terminator
+            content_type_line = self._content_type_lines[self.content_type]
+        # Content-Length is always sent, so persistent connections know where the response ends
+        return content_type_line + b'Content-Length: %d\r\n' % content_length
 
     def head(self):
-        return self.header.encode('utf-8')
+        return self.header
+
+    def content_length(self):
+        return len(self.body())
 
     def body(self):
-        if self.content:
-            if type(self.content) == str:
-                return self.content.encode('utf-8')
-            elif type(self.content) == bytes:
-                return self.content
-            else:
-                raise Exception('Bad content type')
+        return self._body
+
+    def parts(self):
+        """Body as a list of buffers to be sent one after another"""
+        return [self.body()]
+
+    @staticmethod
+    def _encode(content):
+        if not content:
+            return b''
+        if type(content) == str:
+            return content.encode('utf-8')
+        elif isinstance(content, (bytes, bytearray, memoryview)):
+            return content
         else:
+            raise Exception('Bad content type')
+
+
+class FileAnswer(BaseAnswer):
+    """Answer with the body taken from a file on disk. The file is not read here:
+    length comes from stat, the server streams the body with sendfile"""
+    __slots__ = ('path', 'size')
+
+    def __init__(self, path, size, status_code=200, content_type=None, header_only=False, headers=None):
+        self.path = path
+        self.size = size
+        super().__init__(status_code, content_type=content_type, header_only=header_only, headers=headers)
+
+    def content_length(self):
+        return self.size
+
+    def body(self):
+        with open(self.path, 'rb') as f:
+            return f.read(self.size)
+
+
+class CachedAnswer(BaseAnswer):
+    """Answer built from a cache.CacheEntry: encoded body and entity headers are reused"""
+    __slots__ = ('entry', )
+
+    def __init__(self, entry, status_code=200, header_only=False, headers=None):
+        self.entry = entry
+        super().__init__(status_code, content_type=entry.content_type, content=entry.body,
+                         header_only=header_only, headers=headers)
+
+    def entity_headers(self):
+        return self.entry.entity_headers
+
+
+class RangeAnswer(BaseAnswer):
+    """206 Partial Content answer. `data` is a buffer with the whole file (memoryview
+    of mmap or cached body), `ranges` are (first, last) byte positions. Several ranges
+    are sent as multipart/byteranges. Slices of `data` are sent without copying"""
+    __slots__ = ('data', 'ranges', 'boundary', '_parts')
+
+    def __init__(self, data, ranges, content_type=None, header_only=False, headers=None):
+        self.data = memoryview(data)
+        self.ranges = ranges
+        self.boundary = uuid.uuid4().hex
+        self._parts = None
+        super().__init__(206, content_type=content_type, header_only=header_only, headers=headers)
+
+    def entity_headers(self):
+        total = len(self.data)
+        if len(self.ranges) == 1:
+            first, last = self.ranges[0]
+            lines = self._content_type_lines[self.content_type] + \
+                'Content-Range: bytes {}-{}/{}\r\n'.format(first, last, total).encode('ascii')
+        else:
+            lines = 'Content-Type: multipart/byteranges; boundary={}\r\n'.format(self.boundary).encode('ascii')
+        return lines + b'Content-Length: %d\r\n' % self.content_length()
+
+    def parts(self):
+        if self._parts is not None:
+            return self._parts
+        if len(self.ranges) == 1:
+            first, last = self.ranges[0]
+            self._parts = [self.data[first:last + 1]]
+            return self._parts
+
+        self._parts = []
+        part_type = self.content_types[self.content_type]
+        for first, last in self.ranges:
+            part_head = '\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n'.format(
+                self.boundary, part_type, first, last, len(self.data))
+            self._parts.append(part_head.encode('utf-8'))
+            self._parts.append(self.data[first:last + 1])
+        self._parts.append('\r\n--{}--\r\n'.format(self.boundary).encode('utf-8'))
+        return self._parts
+
+    def content_length(self):
+        return sum(len(part) for part in self.parts())
+
+    def body(self):
+        return b''.join(self.parts())
+
+
+class StreamAnswer(BaseAnswer):
+    """Answer with a body produced by an iterator (or async iterator) of byte
+    chunks. Length is not known up front, so the body is sent with
+    Transfer-Encoding: chunked, one chunk at a time. HTTP/1.0 clients get the
+    raw chunks and the end of the body is marked by closing the connection
+    (chunked=False)"""
+    __slots__ = ('chunks', 'chunked')
+    last_chunk = b'0\r\n\r\n'
+
+    def __init__(self, chunks, status_code=200, content_type=None, header_only=False, headers=None, chunked=True):
+        self.chunks = chunks
+        self.chunked = chunked
+        super().__init__(status_code, content_type=content_type, header_only=header_only, headers=headers)
+
+    def entity_headers(self):
+        if self.status == 304:
             return b''
+        content_type_line = self._content_type_lines[self.content_type] if self.content_type else b''
+        return content_type_line + (b'Transfer-Encoding: chunked\r\n' if self.chunked else b'')
+
+    def content_length(self):
+        # Unknown until the iterator is exhausted
+        return 0
+
+    def frame(self, chunk):
+        """Buffers to send for one chunk of the body"""
+        chunk = self._encode(chunk)
+        if not chunk:
+            # Zero-size chunk would end the body
+            return []
+        if not self.chunked:
+            return [chunk]
+        return [b'%x\r\n' % len(chunk), chunk, b'\r\n']
+
+    def close(self):
+        """Releasing the iterator when the body is not sent to the end"""
+        close = getattr(self.chunks, 'aclose', None) or getattr(self.chunks, 'close', None)
+        return close() if close is not None else None
 
 
 # Requests
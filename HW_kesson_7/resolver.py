@@ -0,0 +1,199 @@
+import os
+import stat
+import logging
+import posixpath
+from threading import Event, Lock, Thread
+from collections import OrderedDict
+from urllib.parse import unquote
+from HW_kesson_7.reqresp import BaseAnswer
+
+
+# Content type of files with unknown or no extension
+DEFAULT_CONTENT_TYPE = 'bin'
+
+
+def content_type_of(path):
+    """Content type key (see BaseAnswer.content_types) of the file name"""
+    extension = posixpath.splitext(path)[1][1:].lower()
+    return extension if extension in BaseAnswer.content_types else DEFAULT_CONTENT_TYPE
+
+
+class ResolvedPath:
+    """Request path mapped to the file system. `status` is None for a regular
+    file inside the document root, 404 or 403 otherwise.
+    Entries of the startup index also keep the stat the file had when
+    indexed and whether a precompressed .gz sibling exists"""
+    __slots__ = ('path', 'content_type', 'status', 'stat', 'gzip')
+
+    def __init__(self, path, content_type, status=None, file_stat=None, gzip=None):
+        self.path = path
+        self.content_type = content_type
+        self.status = status
+        self.stat = file_stat
+        # None when unknown
+        self.gzip = gzip
+
+    @property
+    def exists(self):
+        return self.status is None
+
+
+class PathResolver:
+    """Request path to file resolver with a bounded memo cache.
+
+    Paths are percent-decoded and normalised, so dot segments never leave the
+    document root; symbolic links pointing outside of it are answered 403.
+    A trailing slash maps to the directory index file. Results are kept in
+    an LRU of max_entries and dropped all together when a scan finds a
+    directory of the tree changed, i.e. a file was created, removed or renamed.
+    After start() a background thread scans every scan_interval seconds, so
+    requests never wait for the scan.
+
+    After build_index() the resolver knows every file of the tree, so paths
+    are answered without touching the file system; the index is rebuilt
+    when the scan finds the tree changed"""
+    def __init__(self, document_root, index_file='index.html', max_entries=10000, scan_interval=2.):
+        self.document_root = os.path.realpath(document_root)
+        self.index_file = index_file
+        self.max_entries = max_entries
+        self.scan_interval = scan_interval
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.scan_lock = Lock()
+        self.signature = self._scan()
+        self.scanner = None
+        self.stopped = Event()
+        # Absolute file path: ResolvedPath. None until build_index()
+        self.index = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def resolve(self, request_path):
+        with self.lock:
+            resolved = self.entries.get(request_path)
+            if resolved is not None:
+                self.entries.move_to_end(request_path)
+                self.hits += 1
+                return resolved
+            self.misses += 1
+
+        resolved = self._resolve(request_path)
+        with self.lock:
+            self.entries[request_path] = resolved
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return resolved
+
+    def start(self):
+        """Starting the scanner thread of this process"""
+        if self.scanner is None:
+            self.stopped.clear()
+            self.scanner = Thread(target=self._scan_loop, name='path-scanner', daemon=True)
+            self.scanner.start()
+
+    def stop(self):
+        if self.scanner is not None:
+            self.stopped.set()
+            self.scanner.join()
+            self.scanner = None
+
+    def _scan_loop(self):
+        while not self.stopped.wait(self.scan_interval):
+            try:
+                self.revalidate()
+            except Exception:
+                logging.exception('Scanning {} failed.'.format(self.document_root))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _resolve(self, request_path):
+        # Invalid UTF-8 is replaced and can not match a file
+        decoded = unquote(request_path) if '%' in request_path else request_path
+        if '\x00' in decoded:
+            return ResolvedPath(None, None, 404)
+        # Leading slash first: normpath drops '..' segments above it
+        relative = posixpath.normpath('/' + decoded.lstrip('/'))
+        if decoded.endswith('/'):
+            relative = posixpath.join(relative, self.index_file)
+        path = self.document_root + relative.rstrip('/')
+        index = self.index
+        if index is not None:
+            return index.get(path) or ResolvedPath(path, content_type_of(path), 404)
+        return self._stat(path)
+
+    def _stat(self, path):
+        content_type = content_type_of(path)
+        try:
+            file_stat = os.stat(path)
+        except (OSError, ValueError):
+            return ResolvedPath(path, content_type, 404)
+        if not stat.S_ISREG(file_stat.st_mode):
+            return ResolvedPath(path, content_type, 404)
+        real_path = os.path.realpath(path)
+        if real_path != path and not real_path.startswith(self.document_root + os.sep):
+            return ResolvedPath(path, content_type, 403)
+        return ResolvedPath(path, content_type, file_stat=file_stat)
+
+    def build_index(self):
+        """Walking the tree and indexing every regular file. Returns the index"""
+        index = {}
+        for directory, directories, files in os.walk(self.document_root):
+            names = set(files)
+            for name in files:
+                resolved = self._stat(os.path.join(directory, name))
+                if resolved.status == 404:
+                    continue
+                if resolved.exists:
+                    resolved.gzip = name + '.gz' in names
+                index[resolved.path] = resolved
+        with self.lock:
+            self.index = index
+            self.entries.clear()
+        return index
+
+    def revalidate(self):
+        """Clearing the memo (and rebuilding the index) when the directory tree changed.
+        One thread scans, others go on"""
+        if not self.scan_lock.acquire(blocking=False):
+            return
+        try:
+            signature = self._scan()
+            if signature != self.signature:
+                self.signature = signature
+                if self.index is not None:
+                    self.build_index()
+                with self.lock:
+                    self.entries.clear()
+                    self.invalidations += 1
+        finally:
+            self.scan_lock.release()
+
+    def _scan(self):
+        """Modification times of all directories of the tree"""
+        signature = {}
+        directories = [self.document_root]
+        while directories:
+            directory = directories.pop()
+            try:
+                signature[directory] = os.stat(directory).st_mtime_ns
+                with os.scandir(directory) as entries:
+                    directories.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+        return signature
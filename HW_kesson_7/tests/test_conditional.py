@@ -0,0 +1,50 @@
+import os
+import unittest
+
+from HW_kesson_7.httpd import PyServer
+from HW_kesson_7.reqresp import entity_tag, http_date
+
+
+class NotModifiedTests(unittest.TestCase):
+    def setUp(self):
+        self.stat = os.stat(__file__)
+        self.etag = entity_tag(self.stat)
+
+    def not_modified(self, headers, etag=None):
+        return PyServer._not_modified(headers, self.stat, etag or self.etag)
+
+    def test_unconditional(self):
+        self.assertFalse(self.not_modified({}))
+
+    def test_if_none_match(self):
+        self.assertTrue(self.not_modified({'if-none-match': self.etag}))
+        self.assertTrue(self.not_modified({'if-none-match': '"a", {} , "b"'.format(self.etag)}))
+        self.assertFalse(self.not_modified({'if-none-match': '"a", "b"'}))
+        self.assertTrue(self.not_modified({'if-none-match': ' * '}))
+
+    def test_weak_comparison(self):
+        """W/ is ignored on both sides"""
+        weak = entity_tag(self.stat, weak=True)
+        self.assertTrue(self.not_modified({'if-none-match': weak}))
+        self.assertTrue(self.not_modified({'if-none-match': self.etag}, etag=weak))
+        self.assertTrue(self.not_modified({'if-none-match': weak}, etag=weak))
+
+    def test_coded_variant(self):
+        """Tags of encoded variants differ from the identity tag"""
+        gzip_tag = entity_tag(self.stat, 'gzip')
+        self.assertFalse(self.not_modified({'if-none-match': self.etag}, etag=gzip_tag))
+        self.assertTrue(self.not_modified({'if-none-match': gzip_tag}, etag=gzip_tag))
+
+    def test_if_modified_since(self):
+        self.assertTrue(self.not_modified({'if-modified-since': http_date(self.stat.st_mtime)}))
+        self.assertTrue(self.not_modified({'if-modified-since': http_date(self.stat.st_mtime + 3600)}))
+        self.assertFalse(self.not_modified({'if-modified-since': http_date(self.stat.st_mtime - 3600)}))
+        self.assertFalse(self.not_modified({'if-modified-since': 'not a date'}))
+
+    def test_if_none_match_takes_precedence(self):
+        headers = {'if-none-match': '"other"', 'if-modified-since': http_date(self.stat.st_mtime + 3600)}
+        self.assertFalse(self.not_modified(headers))
+
+
+if __name__ == '__main__':
+    unittest.main()
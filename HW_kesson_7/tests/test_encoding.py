@@ -0,0 +1,53 @@
+import gzip
+import unittest
+import zlib
+
+from HW_kesson_7.encoding import compress, negotiate
+
+
+class NegotiateTests(unittest.TestCase):
+    def test_identity(self):
+        self.assertIsNone(negotiate(None))
+        self.assertIsNone(negotiate(''))
+        self.assertIsNone(negotiate('br, identity'))
+
+    def test_preference(self):
+        """Equal weights go by server preference, otherwise the highest q wins"""
+        self.assertEqual(negotiate('deflate, gzip'), 'gzip')
+        self.assertEqual(negotiate('gzip;q=0.5, deflate'), 'deflate')
+        self.assertEqual(negotiate(' GZIP ; Q=0.8 , deflate;q=0.7'), 'gzip')
+
+    def test_refused(self):
+        """q=0 means "not acceptable", also for a bad q-value"""
+        self.assertIsNone(negotiate('gzip;q=0'))
+        self.assertIsNone(negotiate('gzip;q=0.000, deflate;q=0'))
+        self.assertIsNone(negotiate('gzip;q=bad'))
+
+    def test_wildcard(self):
+        self.assertEqual(negotiate('*'), 'gzip')
+        self.assertEqual(negotiate('gzip;q=0, *'), 'deflate')
+        self.assertEqual(negotiate('*;q=0, deflate'), 'deflate')
+        self.assertIsNone(negotiate('*;q=0'))
+
+    def test_available(self):
+        self.assertEqual(negotiate('gzip, deflate', available=('deflate', )), 'deflate')
+        self.assertIsNone(negotiate('gzip', available=()))
+
+
+class CompressTests(unittest.TestCase):
+    def test_round_trip(self):
+        body = b'hello ' * 1000
+        self.assertEqual(gzip.decompress(compress(body, 'gzip')), body)
+        self.assertEqual(zlib.decompress(compress(body, 'deflate')), body)
+
+    def test_stable_output(self):
+        """Same input, same bytes: the gzip header carries no timestamp"""
+        self.assertEqual(compress(b'body', 'gzip'), compress(b'body', 'gzip'))
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            compress(b'body', 'br')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+
+from HW_kesson_7.parser import RequestError, RequestParser
+
+
+class RequestParserTests(unittest.TestCase):
+    def parse(self, data, **limits):
+        parser = RequestParser(**limits)
+        parser.feed(data)
+        return parser.next_request()
+
+    def assertRejected(self, data, status, **limits):
+        with self.assertRaises(RequestError) as raised:
+            self.parse(data, **limits)
+        self.assertEqual(raised.exception.status, status)
+
+    def test_request(self):
+        request = self.parse(b'GET /a%20b?x=1 HTTP/1.1\r\nHost: example\r\nX-A: 1\r\nx-a: 2\r\n\r\n')
+        self.assertEqual((request.method, request.target, request.version), ('GET', '/a%20b?x=1', 'HTTP/1.1'))
+        self.assertEqual(request.path, '/a%20b')
+        self.assertEqual(request.headers, {'host': 'example', 'x-a': '1, 2'})
+        self.assertEqual(request.body, b'')
+
+    def test_bare_lf(self):
+        request = self.parse(b'GET / HTTP/1.0\nHost: example\nAccept: */*\r\n\r\n')
+        self.assertEqual(request.headers, {'host': 'example', 'accept': '*/*'})
+
+    def test_split_terminator(self):
+        """The terminator is found when it is split between reads"""
+        parser = RequestParser()
+        data = b'GET / HTTP/1.1\r\nHost: example\r\n\r\n'
+        for byte in range(len(data) - 1):
+            parser.feed(data[byte:byte + 1])
+            self.assertIsNone(parser.next_request())
+        parser.feed(data[-1:])
+        self.assertEqual(parser.next_request().path, '/')
+        self.assertFalse(parser.has_data())
+
+    def test_body_by_content_length(self):
+        parser = RequestParser()
+        parser.feed(b'POST /form HTTP/1.1\r\nContent-Length: 10\r\n\r\n01234')
+        self.assertIsNone(parser.next_request())
+        self.assertTrue(parser.reading_body)
+        parser.feed(b'56789GET')
+        self.assertEqual(parser.next_request().body, b'0123456789')
+        self.assertFalse(parser.reading_body)
+        self.assertTrue(parser.has_data())
+
+    def test_pipelining(self):
+        parser = RequestParser()
+        parser.feed(b'GET /1 HTTP/1.1\r\n\r\nPOST /2 HTTP/1.1\r\nContent-Length: 2\r\n\r\nokHEAD /3 HTTP/1.1\r\n\r\n')
+        requests = [parser.next_request() for _ in range(3)]
+        self.assertEqual([(request.method, request.path) for request in requests],
+                         [('GET', '/1'), ('POST', '/2'), ('HEAD', '/3')])
+        self.assertEqual(requests[1].body, b'ok')
+        self.assertIsNone(parser.next_request())
+        self.assertFalse(parser.has_data())
+
+    def test_chunked(self):
+        data = (b'POST /upload HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                b'5;name=value\r\nhello\r\nA\r\n, chunked!\r\n0\r\nX-Trailer: 1\r\n\r\n'
+                b'GET /next HTTP/1.1\r\n\r\n')
+        self.assertEqual(self.parse(data).body, b'hello, chunked!')
+
+        # Byte by byte, every decoder state is left waiting for data
+        parser = RequestParser()
+        for byte in range(len(data)):
+            request = parser.next_request()
+            if request is not None:
+                break
+            parser.feed(data[byte:byte + 1])
+        else:
+            request = parser.next_request()
+        self.assertEqual(request.body, b'hello, chunked!')
+        parser.feed(data[byte:])
+        self.assertEqual(parser.next_request().path, '/next')
+
+    def test_bad_request_line(self):
+        self.assertRejected(b'GET /\r\n\r\n', 400)
+        self.assertRejected(b'GET / FTP/1.0\r\n\r\n', 400)
+        self.assertRejected(b'GET / HTTP/1.1\r\nNo colon\r\n\r\n', 400)
+        self.assertRejected(b'GET / HTTP/1.1\r\nHost : example\r\n\r\n', 400)
+
+    def test_bad_content_length(self):
+        self.assertRejected(b'POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n', 400)
+        self.assertRejected(b'POST / HTTP/1.1\r\nContent-Length: 1\r\nContent-Length: 2\r\n\r\n', 400)
+
+    def test_non_ascii_content_length(self):
+        """'²' is a digit to str.isdigit() but not to int()"""
+        self.assertRejected(b'POST / HTTP/1.1\r\nContent-Length: \xb2\r\n\r\n', 400)
+
+    def test_smuggling(self):
+        """Content-Length together with Transfer-Encoding is refused"""
+        self.assertRejected(b'POST / HTTP/1.1\r\nContent-Length: 4\r\nTransfer-Encoding: chunked\r\n\r\n', 400)
+
+    def test_bad_chunks(self):
+        head = b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+        self.assertRejected(head + b'x\r\n', 400)
+        self.assertRejected(head + b'-1\r\n', 400)
+        self.assertRejected(head + b'\xb2\r\n', 400)
+        self.assertRejected(head + b'3\r\nabcd\r\n', 400)
+        self.assertRejected(head + b'1' * 2000, 400)
+
+    def test_unsupported_transfer_encoding(self):
+        self.assertRejected(b'POST / HTTP/1.1\r\nTransfer-Encoding: gzip, chunked\r\n\r\n', 501)
+
+    def test_body_too_large(self):
+        self.assertRejected(b'POST / HTTP/1.1\r\nContent-Length: 11\r\n\r\n', 413, max_body_bytes=10)
+        self.assertRejected(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\n12345\r\n6\r\n',
+                            413, max_body_bytes=10)
+
+    def test_head_too_large(self):
+        self.assertRejected(b'GET / HTTP/1.1\r\nX: ' + b'x' * 100, 431, max_header_bytes=64)
+        self.assertRejected(b'GET / HTTP/1.1\r\nX: ' + b'x' * 100 + b'\r\n\r\n', 431, max_header_bytes=64)
+        self.assertRejected(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n0\r\n' + b'X: 1\r\n' * 20,
+                            431, max_header_bytes=64)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import time
+import unittest
+
+from HW_kesson_7.ranges import RangeNotSatisfiable, if_range_matches, parse_range
+from HW_kesson_7.reqresp import entity_tag, http_date
+
+
+class ParseRangeTests(unittest.TestCase):
+    def test_single(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range('bytes=500-', 1000), [(500, 999)])
+        self.assertEqual(parse_range('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range(' Bytes = 10 - 19 ', 1000), [(10, 19)])
+
+    def test_clamped_to_size(self):
+        self.assertEqual(parse_range('bytes=900-2000', 1000), [(900, 999)])
+        self.assertEqual(parse_range('bytes=-5000', 1000), [(0, 999)])
+
+    def test_merged(self):
+        """Overlapping and adjacent ranges become one, sorted"""
+        self.assertEqual(parse_range('bytes=50-59,0-9,5-19,20-29', 1000), [(0, 29), (50, 59)])
+
+    def test_unsatisfiable_parts_are_dropped(self):
+        self.assertEqual(parse_range('bytes=2000-3000,0-0', 1000), [(0, 0)])
+        self.assertEqual(parse_range('bytes=-0,0-0', 1000), [(0, 0)])
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=1000-', 'bytes=5000-6000', 'bytes=-0'):
+            with self.assertRaises(RangeNotSatisfiable):
+                parse_range(header, 1000)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=0-', 0)
+
+    def test_ignored(self):
+        """Headers answered with the full body"""
+        for header in ('items=0-1', 'bytes=', 'bytes=abc', 'bytes=5', 'bytes=-', 'bytes=9-5',
+                       'bytes=0x1-2', 'bytes=\xb2-', 'bytes=0-\xb2'):
+            self.assertIsNone(parse_range(header, 1000), header)
+
+    def test_too_many_ranges(self):
+        header = 'bytes=' + ','.join('{}-{}'.format(i * 10, i * 10) for i in range(33))
+        self.assertIsNone(parse_range(header, 1000))
+        self.assertEqual(len(parse_range(header, 1000, max_ranges=33)), 33)
+
+
+class IfRangeTests(unittest.TestCase):
+    def setUp(self):
+        self.stat = os.stat(__file__)
+
+    def test_absent(self):
+        self.assertTrue(if_range_matches(None, self.stat))
+        self.assertTrue(if_range_matches('', self.stat))
+
+    def test_entity_tag(self):
+        self.assertTrue(if_range_matches(entity_tag(self.stat), self.stat))
+        self.assertFalse(if_range_matches('"other"', self.stat))
+        # Weak tags never match
+        self.assertFalse(if_range_matches(entity_tag(self.stat, weak=True), self.stat))
+
+    def test_date(self):
+        self.assertTrue(if_range_matches(http_date(self.stat.st_mtime), self.stat))
+        self.assertFalse(if_range_matches(http_date(self.stat.st_mtime - 60), self.stat))
+        self.assertFalse(if_range_matches(http_date(time.time() + 60), self.stat))
+        self.assertFalse(if_range_matches('yesterday', self.stat))
+
+
+if __name__ == '__main__':
+    unittest.main()
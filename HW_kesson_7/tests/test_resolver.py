@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from HW_kesson_7.resolver import DEFAULT_CONTENT_TYPE, PathResolver
+
+
+class PathResolverTests(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+        self.root = os.path.join(self.base, 'www')
+        os.makedirs(os.path.join(self.root, 'docs'))
+        self.write('index.html')
+        self.write('docs/index.html')
+        self.write('docs/page one.html')
+        self.write('data.unknown')
+        self.write('../secret.txt')
+        os.symlink(os.path.join(self.base, 'secret.txt'), os.path.join(self.root, 'leak.txt'))
+        os.symlink(os.path.join(self.root, 'index.html'), os.path.join(self.root, 'alias.html'))
+        self.resolver = PathResolver(self.root)
+
+    def write(self, name, data='x'):
+        with open(os.path.join(self.root, name), 'w') as f:
+            f.write(data)
+
+    def assertServes(self, request_path, name):
+        resolved = self.resolver.resolve(request_path)
+        self.assertTrue(resolved.exists, request_path)
+        self.assertEqual(resolved.path, os.path.join(os.path.realpath(self.root), name))
+
+    def assertStatus(self, request_path, status):
+        self.assertEqual(self.resolver.resolve(request_path).status, status, request_path)
+
+    def test_files(self):
+        self.assertServes('/index.html', 'index.html')
+        self.assertServes('/docs/page%20one.html', 'docs/page one.html')
+        self.assertEqual(self.resolver.resolve('/index.html').content_type, 'html')
+        self.assertEqual(self.resolver.resolve('/data.unknown').content_type, DEFAULT_CONTENT_TYPE)
+
+    def test_directory_index(self):
+        self.assertServes('/', 'index.html')
+        self.assertServes('/docs/', 'docs/index.html')
+        self.assertStatus('/docs', 404)
+        self.assertStatus('/index.html/', 404)
+
+    def test_missing(self):
+        self.assertStatus('/nothing.html', 404)
+        self.assertStatus('/docs/nothing/', 404)
+
+    def test_traversal(self):
+        """Dot segments, encoded or not, never leave the document root"""
+        for request_path in ('/../secret.txt', '/docs/../../secret.txt', '/%2e%2e/secret.txt',
+                             '/%2E%2E%2Fsecret.txt', '/docs/..%2f..%2fsecret.txt', '//../secret.txt'):
+            self.assertStatus(request_path, 404)
+        self.assertServes('/docs/../index.html', 'index.html')
+        self.assertServes('/%2e%2e/%2e%2e/index.html', 'index.html')
+
+    def test_nul_byte(self):
+        self.assertStatus('/index.html%00.txt', 404)
+        self.assertStatus('/index.html\x00', 404)
+
+    def test_symlinks(self):
+        self.assertStatus('/leak.txt', 403)
+        self.assertServes('/alias.html', 'alias.html')
+
+    def test_memo(self):
+        self.resolver.resolve('/index.html')
+        self.resolver.resolve('/index.html')
+        stats = self.resolver.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        resolver = PathResolver(self.root, max_entries=2)
+        for request_path in ('/a', '/b', '/c'):
+            resolver.resolve(request_path)
+        self.assertEqual((resolver.stats()['entries'], resolver.stats()['evictions']), (2, 1))
+
+    def test_revalidate(self):
+        """A new file is found once the tree is rescanned"""
+        self.assertStatus('/docs/new.html', 404)
+        # Directory mtimes must differ
+        time.sleep(0.01)
+        self.write('docs/new.html')
+        self.assertStatus('/docs/new.html', 404)
+        self.resolver.revalidate()
+        self.assertServes('/docs/new.html', 'docs/new.html')
+        self.assertEqual(self.resolver.stats()['invalidations'], 1)
+
+    def test_index(self):
+        index = self.resolver.build_index()
+        self.assertIn(os.path.join(os.path.realpath(self.root), 'docs', 'index.html'), index)
+        self.assertServes('/docs/', 'docs/index.html')
+        self.assertStatus('/leak.txt', 403)
+        self.assertStatus('/../secret.txt', 404)
+        time.sleep(0.01)
+        self.write('added.html')
+        self.resolver.revalidate()
+        self.assertServes('/added.html', 'added.html')
+
+    def test_scanner_thread(self):
+        resolver = PathResolver(self.root, scan_interval=0.01)
+        resolver.start()
+        self.addCleanup(resolver.stop)
+        self.assertEqual(resolver.resolve('/later.html').status, 404)
+        time.sleep(0.01)
+        self.write('later.html')
+        deadline = time.monotonic() + 2
+        while not resolver.resolve('/later.html').exists and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(resolver.resolve('/later.html').exists)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from HW_kesson_7.timers import TimerHeap
+
+
+class TimerHeapTests(unittest.TestCase):
+    def setUp(self):
+        self.timers = TimerHeap()
+
+    def test_expire_order(self):
+        for item, deadline in (('c', 3.), ('a', 1.), ('b', 2.), ('d', 2.)):
+            self.timers.set(item, deadline)
+        self.assertEqual(self.timers.next_deadline(), 1.)
+        self.assertEqual(self.timers.expired(0.5), [])
+        self.assertEqual(self.timers.expired(2.), ['a', 'b', 'd'])
+        self.assertEqual(len(self.timers), 1)
+        self.assertEqual(self.timers.expired(10.), ['c'])
+        self.assertEqual(len(self.timers), 0)
+        self.assertEqual(self.timers.expired(20.), [])
+
+    def test_extend(self):
+        """A later deadline is picked up when the old one comes due"""
+        self.timers.set('a', 1.)
+        self.timers.set('a', 5.)
+        self.assertEqual(self.timers.expired(2.), [])
+        self.assertEqual(len(self.timers), 1)
+        self.assertEqual(self.timers.next_deadline(), 5.)
+        self.assertEqual(self.timers.expired(5.), ['a'])
+
+    def test_shorten(self):
+        self.timers.set('a', 5.)
+        self.timers.set('a', 1.)
+        self.assertEqual(self.timers.expired(1.), ['a'])
+        # The superseded entry does not expire it again
+        self.assertEqual(self.timers.expired(6.), [])
+
+    def test_cancel(self):
+        self.timers.set('a', 1.)
+        self.timers.set('b', 2.)
+        self.timers.cancel('a')
+        self.timers.cancel('missing')
+        self.assertEqual(len(self.timers), 1)
+        self.assertEqual(self.timers.expired(3.), ['b'])
+
+    def test_set_after_cancel(self):
+        self.timers.set('a', 1.)
+        self.timers.cancel('a')
+        self.timers.set('a', 4.)
+        self.assertEqual(self.timers.expired(2.), [])
+        self.assertEqual(self.timers.expired(4.), ['a'])
+
+    def test_many_extensions(self):
+        """Extending on every event does not grow the heap"""
+        for step in range(1000):
+            self.timers.set('a', 10. + step)
+        self.assertEqual(len(self.timers.heap), 1)
+        self.assertEqual(self.timers.expired(1008.), [])
+        self.assertEqual(self.timers.expired(1009.), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
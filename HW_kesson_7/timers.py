@@ -0,0 +1,53 @@
+import heapq
+from itertools import count
+
+
+class TimerHeap:
+    """Deadlines of many items (connections) in one binary heap.
+
+    Moving a deadline later only updates a dict; the heap entry is checked
+    when it comes due and rescheduled if the deadline moved. So frequent
+    extensions (every read or write) cost O(1) and expiring n connections
+    costs O(log n) each, instead of scanning every connection per poll"""
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+        # Time of the live heap entry of each item
+        self.scheduled = {}
+        self.counter = count()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def set(self, item, deadline):
+        self.deadlines[item] = deadline
+        scheduled = self.scheduled.get(item)
+        if scheduled is None or deadline < scheduled:
+            self.scheduled[item] = deadline
+            heapq.heappush(self.heap, (deadline, next(self.counter), item))
+
+    def cancel(self, item):
+        self.deadlines.pop(item, None)
+        self.scheduled.pop(item, None)
+
+    def next_deadline(self):
+        """Earliest time something may expire, None when nothing is scheduled"""
+        return self.heap[0][0] if self.heap else None
+
+    def expired(self, now):
+        """Removing and returning items whose deadline passed"""
+        items = []
+        while self.heap and self.heap[0][0] <= now:
+            when, _, item = heapq.heappop(self.heap)
+            if self.scheduled.get(item) != when:
+                # Superseded by an earlier entry or cancelled
+                continue
+            deadline = self.deadlines[item]
+            if deadline <= now:
+                del self.deadlines[item]
+                del self.scheduled[item]
+                items.append(item)
+            else:
+                self.scheduled[item] = deadline
+                heapq.heappush(self.heap, (deadline, next(self.counter), item))
+        return items
@@ -20,7 +20,11 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # See https://docs.djangoproject.com/en/1.11/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-from .password import key
+# The key lives in the uncommitted mysite/password.py, or comes from the environment
+try:
+    from .password import key
+except ImportError:
+    key = os.environ.get('DJANGO_SECRET_KEY')
 SECRET_KEY = key
 
 # SECURITY WARNING: don't run with debug turned on in production!
@@ -79,9 +83,25 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Connections are kept between requests of a thread
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {
+            # Seconds to wait for a lock held by a writer before failing
+            'timeout': 20,
+        },
     }
 }
 
+# Run on every new connection, see polls/sqlite.py
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative is KiB: 64 MiB
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -120,3 +140,37 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.11/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Vote counting, see polls/votes.py
+# With write-behind votes are journaled and written in batches
+
+POLLS_VOTE_WRITE_BEHIND = False
+
+POLLS_VOTE_FLUSH_INTERVAL = 1.0
+
+POLLS_VOTE_FLUSH_SIZE = 500
+
+POLLS_VOTE_JOURNAL_DIR = os.path.join(BASE_DIR, 'vote_journal')
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'polls',
+    },
+    'files': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'django_cache'),
+    },
+}
+
+# Cache of the polls index and results pages, see polls/caching.py
+# 'files' shares the entries between processes of the host
+
+POLLS_CACHE = 'default'
+
+POLLS_CACHE_TIMEOUT = 300
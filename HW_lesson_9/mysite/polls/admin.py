@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import Choice, Question
+from .search import filter_questions
 
 
 class ChoiceInline(admin.TabularInline):
@@ -18,4 +19,8 @@ class QuestionAdmin(admin.ModelAdmin):
     list_filter = ['pub_date']
     search_fields = ['question_text']
 
+    def get_search_results(self, request, queryset, search_term):
+        # Full-text index instead of LIKE '%term%' over search_fields
+        return filter_questions(queryset, search_term), False
+
 admin.site.register(Question, QuestionAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PollsConfig(AppConfig):
     name = 'polls'
+
+    def ready(self):
+        # Cache invalidation and connection setup receivers
+        from . import caching, sqlite  # noqa: F401
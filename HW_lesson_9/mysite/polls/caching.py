@@ -0,0 +1,121 @@
+"""
+Cache of the polls index list and the rendered results pages.
+
+Entries live in the ``POLLS_CACHE`` cache: local memory (per process) or the
+file based cache (shared by processes of one host). Every entry name has a
+version counter and the key includes the version, so invalidating an entry
+is one ``incr`` and a value computed before the invalidation is stored under
+the old key and never read. The version starts from a nanosecond timestamp,
+so an evicted counter can not reuse the key of a stale entry.
+
+Invalidation:
+
+* a saved or deleted Question: the index and its results page;
+* a saved or deleted Choice, a vote: the results page of its question;
+* a question whose ``pub_date`` is still in the future: the index entry
+  expires when that ``pub_date`` passes.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Choice, Question
+
+INDEX = 'index'
+
+
+def results_name(question_id):
+    return 'results:{}'.format(question_id)
+
+
+class CacheStats:
+    """Hits and misses of this process by entry kind (index, results)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, kind, hit):
+        with self.lock:
+            hits, misses = self.counts.get(kind, (0, 0))
+            self.counts[kind] = (hits + 1, misses) if hit else (hits, misses + 1)
+
+    def snapshot(self):
+        with self.lock:
+            counts = dict(self.counts)
+        return {
+            kind: {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+            }
+            for kind, (hits, misses) in counts.items()
+        }
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    return caches[getattr(settings, 'POLLS_CACHE', 'default')]
+
+
+def _version_key(name):
+    return 'polls:version:{}'.format(name)
+
+
+def _version(cache, name):
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def lookup(name):
+    """(key, value) of the entry, value is None on a miss. The key is for store()"""
+    cache = get_cache()
+    key = 'polls:{}:{}'.format(name, _version(cache, name))
+    value = cache.get(key)
+    stats.count(name.split(':', 1)[0], value is not None)
+    return key, value
+
+
+def store(key, value, timeout=None):
+    """Caching the value for at most POLLS_CACHE_TIMEOUT seconds"""
+    limit = getattr(settings, 'POLLS_CACHE_TIMEOUT', 300)
+    get_cache().set(key, value, limit if timeout is None else min(timeout, limit))
+
+
+def invalidate(*names):
+    cache = get_cache()
+    for name in names:
+        try:
+            cache.incr(_version_key(name))
+        except ValueError:
+            # No version yet: nothing was cached, or the counter was evicted
+            # and the next lookup starts a fresh one
+            pass
+
+
+def invalidate_results(*question_ids):
+    invalidate(*[results_name(question_id) for question_id in question_ids])
+
+
+@receiver((post_save, post_delete), sender=Question, dispatch_uid='polls_caching_question')
+def _question_changed(sender, instance, **kwargs):
+    invalidate(INDEX, results_name(instance.pk))
+
+
+@receiver((post_save, post_delete), sender=Choice, dispatch_uid='polls_caching_choice')
+def _choice_changed(sender, instance, **kwargs):
+    invalidate_results(instance.question_id)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# One row per question, rowid is the question id. Kept in sync by triggers,
+# so bulk updates and raw SQL are indexed too. Updates of Choice.votes do
+# not touch the index.
+CHOICE_TEXT = "(SELECT coalesce(group_concat(choice_text, ' '), '') FROM polls_choice WHERE question_id = {}.question_id)"
+
+FORWARD = [
+    "CREATE VIRTUAL TABLE polls_question_fts USING fts5(question_text, choice_text, tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO polls_question_fts (rowid, question_text, choice_text) "
+    "SELECT id, question_text, (SELECT coalesce(group_concat(choice_text, ' '), '') FROM polls_choice "
+    "WHERE question_id = polls_question.id) FROM polls_question",
+    "CREATE TRIGGER polls_question_fts_insert AFTER INSERT ON polls_question BEGIN "
+    "INSERT INTO polls_question_fts (rowid, question_text, choice_text) VALUES (new.id, new.question_text, ''); END",
+    "CREATE TRIGGER polls_question_fts_update AFTER UPDATE OF question_text ON polls_question BEGIN "
+    "UPDATE polls_question_fts SET question_text = new.question_text WHERE rowid = new.id; END",
+    "CREATE TRIGGER polls_question_fts_delete AFTER DELETE ON polls_question BEGIN "
+    "DELETE FROM polls_question_fts WHERE rowid = old.id; END",
+    "CREATE TRIGGER polls_choice_fts_insert AFTER INSERT ON polls_choice BEGIN "
+    "UPDATE polls_question_fts SET choice_text = " + CHOICE_TEXT.format('new') + " WHERE rowid = new.question_id; END",
+    "CREATE TRIGGER polls_choice_fts_update AFTER UPDATE OF choice_text, question_id ON polls_choice BEGIN "
+    "UPDATE polls_question_fts SET choice_text = " + CHOICE_TEXT.format('old') + " WHERE rowid = old.question_id; "
+    "UPDATE polls_question_fts SET choice_text = " + CHOICE_TEXT.format('new') + " WHERE rowid = new.question_id; END",
+    "CREATE TRIGGER polls_choice_fts_delete AFTER DELETE ON polls_choice BEGIN "
+    "UPDATE polls_question_fts SET choice_text = " + CHOICE_TEXT.format('old') + " WHERE rowid = old.question_id; END",
+]
+
+BACKWARD = [
+    "DROP TRIGGER IF EXISTS polls_choice_fts_delete",
+    "DROP TRIGGER IF EXISTS polls_choice_fts_update",
+    "DROP TRIGGER IF EXISTS polls_choice_fts_insert",
+    "DROP TRIGGER IF EXISTS polls_question_fts_delete",
+    "DROP TRIGGER IF EXISTS polls_question_fts_update",
+    "DROP TRIGGER IF EXISTS polls_question_fts_insert",
+    "DROP TABLE IF EXISTS polls_question_fts",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # Other databases search with LIKE, see polls.search
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_question_listing_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(FORWARD), run(BACKWARD)),
+    ]
@@ -8,6 +8,13 @@ class Question(models.Model):
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published')
 
+    class Meta:
+        indexes = [
+            # Published questions newest first (index page, admin date filter,
+            # next publication time); question_text makes it covering
+            models.Index(fields=['-pub_date', 'question_text'], name='polls_question_listing_idx'),
+        ]
+
     def __str__(self):
         return self.question_text
     
@@ -26,3 +33,12 @@ class Choice(models.Model):
 
     def __str__(self):
         return self.choice_text
+
+
+class AppliedVoteBatch(models.Model):
+    """Journal segment of buffered votes already written to Choice.votes (see polls.votes)"""
+    name = models.CharField(max_length=100, unique=True)
+    applied_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,111 @@
+"""
+Full-text search over question and choice texts.
+
+On SQLite the FTS5 table polls_question_fts (migration 0004) is matched and
+ranked with bm25, a hit in the question text weighing twice a hit in the
+choice texts. Pages are keyset paginated: the cursor is the (score, id) of
+the last result, so a page never builds and throws away the rows of the
+pages before it (as OFFSET does) and stays stable when questions are
+added. Other databases fall back to LIKE with id order.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Question
+
+PAGE_SIZE = 20
+
+# bm25 weights of question_text and choice_text
+WEIGHTS = (2.0, 1.0)
+
+_TOKEN = re.compile(r'\w+')
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(text):
+    """FTS5 query matching every word of the text, the last one as a prefix.
+    Words are quoted, so operators and column filters typed by users are plain
+    text. None when the text has no words"""
+    words = _TOKEN.findall(text)
+    if not words:
+        return None
+    return ' '.join('"{}"'.format(word) for word in words) + '*'
+
+
+def matching_ids(text):
+    """Expression for pk__in with ids of questions matching the text (unranked)"""
+    return RawSQL('SELECT rowid FROM polls_question_fts WHERE polls_question_fts MATCH %s', [match_expression(text)])
+
+
+def filter_questions(queryset, text):
+    """Questions of the queryset matching the text, for the admin search"""
+    if match_expression(text) is None:
+        return queryset
+    if fts_available():
+        return queryset.filter(pk__in=matching_ids(text))
+    words = _TOKEN.findall(text)
+    for word in words:
+        queryset = queryset.filter(Q(question_text__icontains=word) | Q(choice__choice_text__icontains=word))
+    return queryset.distinct()
+
+
+def encode_cursor(question):
+    return '{}:{!r}'.format(question.id, question.score)
+
+
+def decode_cursor(cursor):
+    """(score, id) of the cursor, None when it is missing or malformed"""
+    try:
+        question_id, score = cursor.split(':', 1)
+        return float(score), int(question_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def search(text, published_before, after=None, page_size=PAGE_SIZE):
+    """Page of published questions matching the text, best first, and the cursor
+    of the next page (None on the last page). Questions get a `score` attribute,
+    lower is better"""
+    match = match_expression(text)
+    if match is None:
+        return [], None
+    after = decode_cursor(after)
+    if not fts_available():
+        return _search_like(text, published_before, after, page_size)
+
+    sql = [
+        'SELECT q.id, q.question_text, q.pub_date, m.score FROM ('
+        '  SELECT rowid AS id, bm25(polls_question_fts, %s, %s) AS score'
+        '  FROM polls_question_fts WHERE polls_question_fts MATCH %s'
+        ') m JOIN polls_question q ON q.id = m.id WHERE q.pub_date <= %s',
+    ]
+    params = list(WEIGHTS) + [match, published_before]
+    if after is not None:
+        sql.append('AND (m.score > %s OR (m.score = %s AND m.id > %s))')
+        params += [after[0], after[0], after[1]]
+    sql.append('ORDER BY m.score, m.id LIMIT %s')
+    params.append(page_size + 1)
+    return _page(list(Question.objects.raw(' '.join(sql), params)), page_size)
+
+
+def _search_like(text, published_before, after, page_size):
+    queryset = filter_questions(Question.objects.filter(pub_date__lte=published_before), text)
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after[1])
+    questions = list(queryset.order_by('pk')[:page_size + 1])
+    for question in questions:
+        question.score = 0.
+    return _page(questions, page_size)
+
+
+def _page(questions, page_size):
+    if len(questions) > page_size:
+        questions = questions[:page_size]
+        return questions, encode_cursor(questions[-1])
+    return questions, None
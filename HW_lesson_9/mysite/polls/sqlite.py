@@ -0,0 +1,22 @@
+"""
+Connection setup for SQLite.
+
+WAL lets readers go on while a vote is written (the default rollback
+journal locks the whole file), synchronous=NORMAL syncs on checkpoints
+instead of every commit, reads of the mapped part of the file skip the
+read() copies and a larger page cache keeps the hot tables in memory.
+journal_mode is stored in the database file, the others are per
+connection, so every new connection runs SQLITE_PRAGMAS.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created, dispatch_uid='polls_sqlite_pragmas')
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
@@ -1,10 +1,31 @@
 from django.urls import reverse
 import datetime
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
 
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-from .models import Question
+from . import caching, votes
+from .models import AppliedVoteBatch, Choice, Question
+from .search import search
+from .votes import VoteBuffer, prune_applied, replay_journal
+
+
+class PollsTestCase(TestCase):
+    """
+    Starts every test with an empty polls cache: rolled back rows send no
+    signals, so entries of the previous test would still look valid.
+    """
+    def setUp(self):
+        caching.get_cache().clear()
+        caching.stats.reset()
 
 
 class QuestionModelTests(TestCase):
@@ -46,7 +67,7 @@ def create_question(question_text, days):
     return Question.objects.create(question_text=question_text, pub_date=time)
 
 
-class QuestionIndexViewTests(TestCase):
+class QuestionIndexViewTests(PollsTestCase):
     def test_no_questions(self):
         """
         If no questions exist, an appropriate message is displayed.
@@ -103,7 +124,7 @@ class QuestionIndexViewTests(TestCase):
             ['<Question: Past question 2.>', '<Question: Past question 1.>']
         )
 
-class QuestionDetailViewTests(TestCase):
+class QuestionDetailViewTests(PollsTestCase):
     def test_future_question(self):
         """
         The detail view of a question with a pub_date in the future
@@ -123,3 +144,364 @@ class QuestionDetailViewTests(TestCase):
         url = reverse('polls:detail', args=(past_question.id,))
         response = self.client.get(url)
         self.assertContains(response, past_question.question_text)
+
+
+class VoteTests(PollsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.question = create_question(question_text='Question.', days=-1)
+        self.first = self.question.choice_set.create(choice_text='First')
+        self.second = self.question.choice_set.create(choice_text='Second')
+        self.journal = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal)
+
+    def test_vote_increments_in_database(self):
+        """
+        vote() adds to the stored counter, not to the stale loaded value.
+        """
+        Choice.objects.filter(pk=self.first.pk).update(votes=10)
+        url = reverse('polls:vote', args=(self.question.id,))
+        response = self.client.post(url, {'choice': self.first.pk})
+        self.assertEqual(response.status_code, 302)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 11)
+
+    def test_buffer_flush(self):
+        """
+        Buffered votes are written in one flush and the journal segment is removed.
+        """
+        buffer = VoteBuffer(self.journal, flush_interval=3600, flush_size=100)
+        for choice in (self.first, self.first, self.second):
+            buffer.add(choice.pk)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+        self.assertEqual(buffer.flush(), 3)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (2, 1))
+        self.assertEqual(os.listdir(self.journal), [buffer.segment])
+
+    def test_replay_orphan_segment(self):
+        """
+        A segment left by a crashed process is applied once; a torn last line is skipped.
+        """
+        with open(os.path.join(self.journal, '1-1-1.log'), 'w') as segment:
+            segment.write('{0}\n{0}\n{1}\n{0}'.format(self.first.pk, self.second.pk))
+        self.assertEqual(replay_journal(self.journal), 3)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 2)
+        self.assertEqual(os.listdir(self.journal), [])
+
+    def test_failed_flush_is_retried(self):
+        """
+        Votes of a flush the database refused are written by the next flush.
+        """
+        buffer = VoteBuffer(self.journal, flush_interval=3600, flush_size=100)
+        apply_segment = votes.apply_segment
+        attempts = []
+
+        def locked_once(name, counts):
+            attempts.append(name)
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+            return apply_segment(name, counts)
+
+        with mock.patch('polls.votes.apply_segment', side_effect=locked_once):
+            buffer.add(self.first.pk)
+            self.assertEqual(buffer.flush(), 0)
+            self.assertEqual(len(buffer.failed), 1)
+            self.assertEqual(len(os.listdir(self.journal)), 2)
+            buffer.add(self.second.pk)
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(buffer.failed, [])
+        self.assertEqual(attempts[0], attempts[1])
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (1, 1))
+        self.assertEqual(os.listdir(self.journal), [buffer.segment])
+
+    def test_flush_prunes_applied_batches(self):
+        """
+        Only batches a segment on disk may still need are kept.
+        """
+        buffer = VoteBuffer(self.journal, flush_interval=3600, flush_size=100)
+        for _ in range(3):
+            buffer.add(self.first.pk)
+            buffer.flush()
+        self.assertEqual(AppliedVoteBatch.objects.count(), 1)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 3)
+
+    def test_prune_keeps_batches_of_segments_on_disk(self):
+        """
+        A segment applied but not yet removed (crash in between) keeps its row.
+        """
+        name = '1-{}-1.log'.format(time.time_ns())
+        with open(os.path.join(self.journal, name), 'w') as segment:
+            segment.write('{}\n'.format(self.first.pk))
+        AppliedVoteBatch.objects.create(name=name)
+        self.assertEqual(prune_applied(self.journal), 0)
+        self.assertEqual(replay_journal(self.journal), 0)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+        self.assertFalse(AppliedVoteBatch.objects.exists())
+
+    def test_replay_skips_applied_segment(self):
+        """
+        A segment flushed before the process died is not applied twice.
+        """
+        AppliedVoteBatch.objects.create(name='1-1-1.log')
+        with open(os.path.join(self.journal, '1-1-1.log'), 'w') as segment:
+            segment.write('{}\n'.format(self.first.pk))
+        self.assertEqual(replay_journal(self.journal), 0)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+        self.assertEqual(os.listdir(self.journal), [])
+
+
+class QueryBudgetMixin:
+    """
+    assertMaxQueries() fails when the block runs more than `budget` queries
+    and lists the queries it ran. Savepoints of atomic blocks are not counted.
+    """
+    class _Budget(CaptureQueriesContext):
+        def __init__(self, test, budget):
+            super().__init__(connection)
+            self.test = test
+            self.budget = budget
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            super().__exit__(exc_type, exc_value, traceback)
+            queries = [query['sql'] for query in self.captured_queries
+                       if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT'))]
+            if exc_type is None and len(queries) > self.budget:
+                self.test.fail('{} queries executed, budget is {}:\n{}'.format(
+                    len(queries), self.budget, '\n'.join('{}. {}'.format(i, sql) for i, sql in enumerate(queries, 1))
+                ))
+
+    def assertMaxQueries(self, budget):
+        return self._Budget(self, budget)
+
+
+class QueryBudgetTests(QueryBudgetMixin, PollsTestCase):
+    """
+    Every polls endpoint runs a fixed number of queries, however many
+    questions and choices there are.
+    """
+    def setUp(self):
+        super().setUp()
+        for number in range(6):
+            question = create_question(question_text='Question {}.'.format(number), days=-1)
+            for choice in range(5):
+                question.choice_set.create(choice_text='Choice {}.'.format(choice))
+        self.question = question
+        self.choice = question.choice_set.first()
+
+    def test_index(self):
+        # Published questions, next publication time
+        with self.assertMaxQueries(2):
+            self.client.get(reverse('polls:index'))
+        with self.assertMaxQueries(0):
+            self.client.get(reverse('polls:index'))
+
+    def test_detail(self):
+        with self.assertMaxQueries(2):
+            response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertContains(response, 'Choice 4.')
+
+    def test_results(self):
+        with self.assertMaxQueries(2):
+            response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, 'Choice 4.')
+        with self.assertMaxQueries(0):
+            response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, 'Choice 4.')
+
+    def test_vote(self):
+        with self.assertMaxQueries(2):
+            response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+        self.assertEqual(response.status_code, 302)
+
+    def test_vote_without_choice(self):
+        with self.assertMaxQueries(2):
+            response = self.client.post(reverse('polls:vote', args=(self.question.id,)))
+        self.assertContains(response, 'select a choice.')
+
+    def test_vote_foreign_choice(self):
+        """
+        A choice of another question is not counted.
+        """
+        url = reverse('polls:vote', args=(self.question.id - 1,))
+        response = self.client.post(url, {'choice': self.choice.id})
+        self.assertContains(response, 'select a choice.')
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 0)
+
+    def test_admin_changelist(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        # Session, user, count, filtered count, list
+        with self.assertMaxQueries(5):
+            response = self.client.get(reverse('admin:polls_question_changelist'))
+        self.assertContains(response, 'Question 5.')
+
+    def test_admin_change(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        # Session, user, question, choices of the inline, content type of the history link
+        with self.assertMaxQueries(5):
+            response = self.client.get(reverse('admin:polls_question_change', args=(self.question.id,)))
+        self.assertContains(response, 'Choice 4.')
+
+
+class CacheTests(PollsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.question = create_question(question_text='Question.', days=-1)
+        self.choice = self.question.choice_set.create(choice_text='Choice.')
+        self.other = create_question(question_text='Other question.', days=-1)
+
+    def results(self, question):
+        return self.client.get(reverse('polls:results', args=(question.id,)))
+
+    def test_new_question_invalidates_index(self):
+        self.assertNotContains(self.client.get(reverse('polls:index')), 'New question.')
+        create_question(question_text='New question.', days=-1)
+        self.assertContains(self.client.get(reverse('polls:index')), 'New question.')
+
+    def test_publication_expires_index(self):
+        """
+        A future question shows up once its pub_date passes, without any save.
+        """
+        Question.objects.create(question_text='Soon.', pub_date=timezone.now() + datetime.timedelta(seconds=0.5))
+        self.assertNotContains(self.client.get(reverse('polls:index')), 'Soon.')
+        time.sleep(0.6)
+        self.assertContains(self.client.get(reverse('polls:index')), 'Soon.')
+
+    def test_vote_invalidates_only_its_results(self):
+        self.results(self.question)
+        self.results(self.other)
+        self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+        self.assertContains(self.results(self.question), '1 vote')
+        self.results(self.other)
+        self.assertEqual(caching.stats.snapshot()['results'], {'hits': 1, 'misses': 3, 'hit_rate': 0.25})
+
+    def test_choice_edit_invalidates_results(self):
+        self.results(self.question)
+        self.choice.choice_text = 'Renamed.'
+        self.choice.save()
+        self.assertContains(self.results(self.question), 'Renamed.')
+
+    def test_buffered_votes_invalidate_results_on_flush(self):
+        journal = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal)
+        buffer = VoteBuffer(journal, flush_interval=3600, flush_size=100)
+        self.results(self.question)
+        buffer.add(self.choice.id)
+        self.assertContains(self.results(self.question), '0 votes')
+        buffer.flush()
+        self.assertContains(self.results(self.question), '1 vote')
+
+    def test_file_cache(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        caches = {'files': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}
+        with override_settings(CACHES=caches, POLLS_CACHE='files'):
+            self.results(self.question)
+            with self.assertNumQueries(0):
+                self.results(self.question)
+            self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+            self.assertContains(self.results(self.question), '1 vote')
+
+    def test_stats_view(self):
+        self.client.get(reverse('polls:index'))
+        self.client.get(reverse('polls:index'))
+        self.assertEqual(self.client.get(reverse('polls:cache_stats')).status_code, 302)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('polls:cache_stats'))
+        self.assertEqual(response.json()['index'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+
+class DatabaseTuningTests(TestCase):
+    def test_pragmas(self):
+        """
+        Every connection runs SQLITE_PRAGMAS.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64 * 1024)
+
+    def test_listing_uses_index(self):
+        """
+        The index page query is answered from the covering index, without a sort.
+        """
+        queryset = Question.objects.filter(pub_date__lte=timezone.now()).order_by('-pub_date')[:5]
+        plan = queryset.explain()
+        self.assertIn('polls_question_listing_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class SearchTests(PollsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.python = create_question(question_text='Favourite python release?', days=-1)
+        self.python.choice_set.create(choice_text='3.6')
+        self.snake = create_question(question_text='Favourite animal?', days=-1)
+        self.snake.choice_set.create(choice_text='Python')
+
+    def ids(self, text, after=None, page_size=20):
+        questions, cursor = search(text, timezone.now(), after=after, page_size=page_size)
+        return [question.id for question in questions], cursor
+
+    def test_question_text_ranks_first(self):
+        self.assertEqual(self.ids('python')[0], [self.python.id, self.snake.id])
+
+    def test_prefix_and_quoting(self):
+        """
+        The last word matches as a prefix; FTS operators are plain words.
+        """
+        self.assertCountEqual(self.ids('favourite pyth')[0], [self.python.id, self.snake.id])
+        self.assertEqual(self.ids('choice_text: animal "python')[0], [])
+        self.assertEqual(self.ids('animal: "python')[0], [self.snake.id])
+        self.assertEqual(self.ids('*')[0], [])
+
+    def test_index_follows_changes(self):
+        choice = self.snake.choice_set.get()
+        choice.choice_text = 'Cobra'
+        choice.save()
+        self.assertEqual(self.ids('python')[0], [self.python.id])
+        self.snake.choice_set.create(choice_text='Python regius')
+        self.assertEqual(self.ids('regius')[0], [self.snake.id])
+        Question.objects.filter(pk=self.python.pk).update(question_text='Favourite editor?')
+        self.assertEqual(self.ids('editor')[0], [self.python.id])
+        self.python.delete()
+        self.assertEqual(self.ids('favourite')[0], [self.snake.id])
+
+    def test_future_questions_hidden(self):
+        create_question(question_text='Future python question.', days=30)
+        self.assertEqual(self.ids('python')[0], [self.python.id, self.snake.id])
+
+    def test_keyset_pages(self):
+        expected = [self.python.id, self.snake.id] + [
+            create_question(question_text='Python {}?'.format(number), days=-1).id for number in range(5)
+        ]
+        seen, cursor = self.ids('python', page_size=3)
+        while cursor is not None:
+            page, cursor = self.ids('python', after=cursor, page_size=3)
+            seen += page
+        self.assertEqual(sorted(seen), sorted(expected))
+
+    def test_view(self):
+        for number in range(25):
+            create_question(question_text='Poll {}?'.format(number), days=-1)
+        response = self.client.get(reverse('polls:search'), {'q': 'poll'})
+        self.assertEqual(len(response.context['questions']), 20)
+        response = self.client.get(reverse('polls:search'), {'q': 'poll', 'after': response.context['next_cursor']})
+        self.assertEqual(len(response.context['questions']), 5)
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertContains(self.client.get(reverse('polls:search'), {'q': 'nothing'}), 'No polls match.')
+
+    def test_admin_search(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('admin:polls_question_changelist'), {'q': 'animal'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.snake])
@@ -1,10 +1,13 @@
 from django.utils import timezone
 from django.shortcuts import get_object_or_404, render
-from django.http import HttpResponseRedirect
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.urls import reverse
 from django.views import generic
 
+from . import caching, search as polls_search
 from .models import Choice, Question
+from .votes import record_vote
 
 
 class IndexView(generic.ListView):
@@ -14,11 +17,21 @@ class IndexView(generic.ListView):
     def get_queryset(self):
         """
         Return the last five published questions (not including those set to be
-        published in the future).
+        published in the future). The list is cached until a question
+        changes or the next future question gets published.
         """
-        return Question.objects.filter(
-            pub_date__lte=timezone.now()
-        ).order_by('-pub_date')[:5]
+        key, questions = caching.lookup(caching.INDEX)
+        if questions is None:
+            now = timezone.now()
+            questions = list(Question.objects.filter(
+                pub_date__lte=now
+            ).order_by('-pub_date')[:5])
+            next_pub_date = Question.objects.filter(
+                pub_date__gt=now
+            ).order_by('pub_date').values_list('pub_date', flat=True).first()
+            timeout = None if next_pub_date is None else (next_pub_date - now).total_seconds()
+            caching.store(key, questions, timeout)
+        return questions
 
 class DetailView(generic.DetailView):
     model = Question
@@ -26,29 +39,61 @@ class DetailView(generic.DetailView):
 
     def get_queryset(self):
         """
-        Excludes any questions that aren't published yet.
+        Excludes any questions that aren't published yet. Choices are
+        fetched in one query up front instead of by the template.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        return Question.objects.filter(pub_date__lte=timezone.now()).prefetch_related('choice_set')
 
 class ResultsView(generic.DetailView):
     model = Question
     template_name = 'polls/results.html'
 
+    def get_queryset(self):
+        return Question.objects.prefetch_related('choice_set')
+
+    def get(self, request, *args, **kwargs):
+        """
+        Serves the page rendered before until a vote or an edit of the question.
+        """
+        key, content = caching.lookup(caching.results_name(kwargs['pk']))
+        if content is not None:
+            return HttpResponse(content)
+        response = super().get(request, *args, **kwargs)
+        caching.store(key, response.render().content)
+        return response
+
 
 def vote(request, question_id):
-    question = get_object_or_404(Question, pk=question_id)
     try:
-        selected_choice = question.choice_set.get(pk=request.POST['choice'])
-    except (KeyError, Choice.DoesNotExist):
+        # The choice is checked to belong to the question in the same query
+        selected_choice = Choice.objects.only('pk').get(pk=request.POST['choice'], question_id=question_id)
+    except (KeyError, ValueError, Choice.DoesNotExist):
+        question = get_object_or_404(Question.objects.prefetch_related('choice_set'), pk=question_id)
         # Redisplay the question voting form.
         return render(request, 'polls/detail.html', {
             'question': question,
             'error_message': "You didn't select a choice.",
         })
     else:
-        selected_choice.votes += 1
-        selected_choice.save()
+        # One atomic UPDATE, concurrent votes are never lost
+        record_vote(selected_choice.pk, question_id)
         # Always return an HttpResponseRedirect after successfully dealing
         # with POST data. This prevents data from being posted twice if a
         # user hits the Back button.
-        return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+        return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    questions, cursor = polls_search.search(query, timezone.now(), after=request.GET.get('after'))
+    return render(request, 'polls/search.html', {
+        'query': query,
+        'questions': questions,
+        'next_cursor': cursor,
+    })
+
+
+@staff_member_required
+def cache_stats(request):
+    """Hit rates of the polls cache in this process"""
+    return JsonResponse(caching.stats.snapshot())
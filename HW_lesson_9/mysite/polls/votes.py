@@ -0,0 +1,250 @@
+"""
+Vote counting.
+
+By default every vote is one atomic ``UPDATE ... SET votes = votes + 1``.
+With ``POLLS_VOTE_WRITE_BEHIND = True`` votes are counted in memory and
+written in batches, one ``UPDATE ... CASE`` statement per flush, every
+``POLLS_VOTE_FLUSH_INTERVAL`` seconds or ``POLLS_VOTE_FLUSH_SIZE`` votes.
+Every vote is first appended to a journal segment in
+``POLLS_VOTE_JOURNAL_DIR``. A flush applies the segment and records its
+name in ``AppliedVoteBatch`` in one transaction, so segments left by a
+crashed process are replayed exactly once. Names no segment on disk can
+need any more are pruned after every flush and replay.
+"""
+import atexit
+import fcntl
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .caching import invalidate_results
+from .models import AppliedVoteBatch, Choice
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.log'
+
+
+def record_vote(choice_id, question_id):
+    """Counting one vote for the choice of the question"""
+    if getattr(settings, 'POLLS_VOTE_WRITE_BEHIND', False):
+        # Results are invalidated when the batch is written
+        get_buffer().add(choice_id)
+    else:
+        Choice.objects.filter(pk=choice_id).update(votes=F('votes') + 1)
+        invalidate_results(question_id)
+
+
+def apply_counts(counts):
+    """One UPDATE adding counts ({choice id: votes}) to the choices"""
+    if not counts:
+        return 0
+    increment = Case(
+        *[When(pk=choice_id, then=Value(count)) for choice_id, count in counts.items()],
+        default=Value(0),
+        output_field=IntegerField()
+    )
+    return Choice.objects.filter(pk__in=list(counts)).update(votes=F('votes') + increment)
+
+
+def apply_segment(name, counts):
+    """Applying the journal segment unless it is applied already. The segment
+    name is inserted first, so a concurrent replay of the same segment fails
+    on the unique constraint before touching the counters"""
+    try:
+        with transaction.atomic():
+            AppliedVoteBatch.objects.create(name=name)
+            apply_counts(counts)
+    except IntegrityError:
+        return False
+    if counts:
+        invalidate_results(*set(Choice.objects.filter(pk__in=list(counts)).values_list('question_id', flat=True)))
+    return True
+
+
+def read_segment(path):
+    """Votes of a journal segment. A torn last line (crash while writing) is skipped"""
+    with open(path, 'rb') as journal:
+        data = journal.read()
+    counts = Counter()
+    for line in data.split(b'\n')[:-1]:
+        if line.isdigit():
+            counts[int(line)] += 1
+    return counts
+
+
+def segment_time(name):
+    """time.time_ns() of the segment creation, from its name"""
+    try:
+        return int(name.split('-')[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def prune_applied(directory):
+    """Deleting AppliedVoteBatch rows no segment on disk can need. A row is
+    written after its segment is created, so rows applied before the oldest
+    segment on disk (and before the directory is listed, segments created
+    meanwhile are not seen) belong to removed segments. Returns the number
+    of deleted rows"""
+    listed_at = time.time_ns()
+    oldest = min([segment_time(name) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)] + [listed_at])
+    cutoff = datetime.fromtimestamp(oldest / 1e9, tz=timezone.utc)
+    return AppliedVoteBatch.objects.filter(applied_at__lt=cutoff).delete()[0]
+
+
+def replay_journal(directory):
+    """Applying segments of crashed processes. A live process keeps its segment
+    locked, so only orphans are replayed. Returns the number of replayed votes"""
+    replayed = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(SEGMENT_SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            if not os.path.exists(path):
+                # Flushed and removed by its owner meanwhile
+                continue
+            counts = read_segment(path)
+            if apply_segment(name, counts):
+                replayed += sum(counts.values())
+            os.unlink(path)
+        finally:
+            os.close(fd)
+    if replayed:
+        logger.warning('Replayed %d journaled votes', replayed)
+    prune_applied(directory)
+    return replayed
+
+
+class VoteBuffer:
+    """Per-process write-behind vote counter with an append-only journal"""
+
+    def __init__(self, directory, flush_interval=1.0, flush_size=500, fsync=False):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        # Serialises flushes, votes keep coming in while a batch is written
+        self.flush_lock = threading.Lock()
+        self.counts = Counter()
+        self.pending = 0
+        self.sequence = 0
+        self.flushed_at = time.monotonic()
+        self.segment = None
+        self.fd = None
+        # (name, fd, counts) of segments whose flush failed, retried by the next flush
+        self.failed = []
+        self.thread = None
+        self.stopped = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self._open_segment()
+
+    def add(self, choice_id):
+        line = b'%d\n' % choice_id
+        with self.lock:
+            # Journal first: a vote is accepted only when it can be replayed
+            os.write(self.fd, line)
+            if self.fsync:
+                os.fsync(self.fd)
+            self.counts[choice_id] += 1
+            self.pending += 1
+            due = self.pending >= self.flush_size or time.monotonic() - self.flushed_at >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writing buffered votes in one UPDATE, after retrying batches that
+        failed before. Returns the number of votes written"""
+        with self.flush_lock:
+            with self.lock:
+                self.flushed_at = time.monotonic()
+                if self.pending:
+                    self.failed.append((self.segment, self.fd, self.counts))
+                    self.counts, self.pending = Counter(), 0
+                    self._open_segment()
+            if not self.failed:
+                return 0
+            written = 0
+            failed = []
+            for name, fd, counts in self.failed:
+                try:
+                    apply_segment(name, counts)
+                except Exception:
+                    # E.g. the database is locked. The segment stays on disk and
+                    # locked by this process until a later flush applies it
+                    logger.exception('Vote flush failed, %s is kept for retry', name)
+                    failed.append((name, fd, counts))
+                    continue
+                os.unlink(os.path.join(self.directory, name))
+                os.close(fd)
+                written += sum(counts.values())
+            self.failed = failed
+            if written:
+                try:
+                    prune_applied(self.directory)
+                except Exception:
+                    logger.exception('Pruning applied vote batches failed')
+            return written
+
+    def start(self):
+        """Flushing on interval from a background thread, also when no votes arrive"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='vote-flusher', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.flush()
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def _open_segment(self):
+        self.sequence += 1
+        self.segment = '{}-{}-{}{}'.format(os.getpid(), time.time_ns(), self.sequence, SEGMENT_SUFFIX)
+        self.fd = os.open(os.path.join(self.directory, self.segment),
+                          os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Vote buffer of this process, created on first use after replaying orphan segments"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                directory = getattr(settings, 'POLLS_VOTE_JOURNAL_DIR',
+                                    os.path.join(settings.BASE_DIR, 'vote_journal'))
+                os.makedirs(directory, exist_ok=True)
+                replay_journal(directory)
+                _buffer = VoteBuffer(
+                    directory,
+                    flush_interval=getattr(settings, 'POLLS_VOTE_FLUSH_INTERVAL', 1.0),
+                    flush_size=getattr(settings, 'POLLS_VOTE_FLUSH_SIZE', 500),
+                    fsync=getattr(settings, 'POLLS_VOTE_JOURNAL_FSYNC', False),
+                )
+                _buffer.start()
+                atexit.register(_buffer.stop)
+    return _buffer